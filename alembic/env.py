@@ -8,7 +8,9 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from app import create_app
+# Import the metadata directly rather than building the Flask app: blueprints,
+# CSRF, rate limiting and log handlers are irrelevant to migrations.
+from config import get_config
 from models import db
 
 # this is the Alembic Config object, which provides
@@ -21,37 +23,51 @@ if config.config_file_name is not None:
 
 # Prefer DATABASE_URL env var; fallback to app config
 flask_env = os.getenv("FLASK_ENV") or "production"
-app = create_app(flask_env)
-with app.app_context():
-    db_url = os.getenv("DATABASE_URL") or app.config.get("SQLALCHEMY_DATABASE_URI")
-    target_metadata = db.metadata
+db_url = os.getenv("DATABASE_URL") or get_config(flask_env).SQLALCHEMY_DATABASE_URI
+target_metadata = db.metadata
 
-    def run_migrations_offline():
-        url = db_url
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keep the search objects created by raw DDL out of autogenerate."""
+    # stash_fts and its FTS5 shadow tables (SQLite), and the tsvector
+    # expression index (PostgreSQL), are not part of the model metadata
+    if type_ == "table" and name.startswith("stash_fts"):
+        return False
+    if type_ == "index" and name == "ix_stashes_search":
+        return False
+    return True
+
+
+def run_migrations_offline():
+    url = db_url
+    context.configure(
+        url=url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        compare_type=True,
+        include_object=include_object,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connectable = create_engine(db_url, poolclass=pool.NullPool)
+
+    with connectable.connect() as connection:
         context.configure(
-            url=url,
+            connection=connection,
             target_metadata=target_metadata,
-            literal_binds=True,
             compare_type=True,
+            include_object=include_object,
         )
 
         with context.begin_transaction():
             context.run_migrations()
 
-    def run_migrations_online():
-        connectable = create_engine(db_url, poolclass=pool.NullPool)
-
-        with connectable.connect() as connection:
-            context.configure(
-                connection=connection,
-                target_metadata=target_metadata,
-                compare_type=True,
-            )
-
-            with context.begin_transaction():
-                context.run_migrations()
 
-    if context.is_offline_mode():
-        run_migrations_offline()
-    else:
-        run_migrations_online()
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
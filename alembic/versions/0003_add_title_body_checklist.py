@@ -14,28 +14,56 @@ down_revision = "0002_add_email_verification"
 branch_labels = None
 depends_on = None
 
+BATCH_SIZE = 10000
+
+
+def _copy_column(source: str, target: str) -> None:
+    """Copy one stashes column into another in keyset-paginated batches."""
+    if op.get_context().as_sql:
+        op.execute(f"UPDATE stashes SET {target} = {source}")
+        return
+
+    conn = op.get_bind()
+    select_ids = sa.text(
+        "SELECT id FROM stashes WHERE id > :last_id ORDER BY id LIMIT :limit"
+    )
+    update_batch = sa.text(
+        f"UPDATE stashes SET {target} = {source} WHERE id IN :ids"
+    ).bindparams(sa.bindparam("ids", expanding=True))
+
+    last_id = ""
+    while True:
+        ids = [
+            row[0]
+            for row in conn.execute(select_ids, {"last_id": last_id, "limit": BATCH_SIZE})
+        ]
+        if not ids:
+            break
+        conn.execute(update_batch, {"ids": ids})
+        last_id = ids[-1]
+
 
 def upgrade() -> None:
-    with op.batch_alter_table("stashes") as batch:
-        batch.add_column(sa.Column("title", sa.String(length=200)))
-        batch.add_column(sa.Column("body", sa.Text()))
-        batch.add_column(sa.Column("checklist", sa.Text()))
+    # Plain ADD COLUMN needs no table rebuild, even on SQLite; only the
+    # NOT NULL change and the drop go through a (single) batch copy.
+    op.add_column("stashes", sa.Column("title", sa.String(length=200)))
+    op.add_column("stashes", sa.Column("body", sa.Text()))
+    op.add_column("stashes", sa.Column("checklist", sa.Text()))
 
-    op.execute("UPDATE stashes SET body = text")
+    _copy_column("text", "body")
 
     with op.batch_alter_table("stashes") as batch:
-        batch.alter_column("body", nullable=False)
+        batch.alter_column("body", existing_type=sa.Text(), nullable=False)
         batch.drop_column("text")
 
 
 def downgrade() -> None:
-    with op.batch_alter_table("stashes") as batch:
-        batch.add_column(sa.Column("text", sa.Text(), nullable=True))
+    op.add_column("stashes", sa.Column("text", sa.Text(), nullable=True))
 
-    op.execute("UPDATE stashes SET text = body")
+    _copy_column("body", "text")
 
     with op.batch_alter_table("stashes") as batch:
         batch.drop_column("checklist")
         batch.drop_column("body")
         batch.drop_column("title")
-        batch.alter_column("text", nullable=False)
+        batch.alter_column("text", existing_type=sa.Text(), nullable=False)
@@ -0,0 +1,25 @@
+"""Lowercase stored user emails.
+
+Revision ID: 0005_lowercase_user_emails
+Revises: 0004_add_relay_sessions
+Create Date: 2026-10-15
+"""
+
+from alembic import op
+
+
+revision = "0005_lowercase_user_emails"
+down_revision = "0004_add_relay_sessions"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Email lookups compare against the unique index directly, so rows
+    # created before emails were normalized must be lowercased.
+    op.execute("UPDATE users SET email = lower(email) WHERE email <> lower(email)")
+
+
+def downgrade() -> None:
+    # Original casing is not recoverable; lowercased emails remain valid.
+    pass
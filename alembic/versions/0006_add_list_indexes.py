@@ -0,0 +1,65 @@
+"""Add composite indexes for stash and relay entry listings.
+
+Relay entry positions become unique per session, so two appends racing for
+the same position fail instead of both landing. Sessions that already hold
+duplicate positions are renumbered first, keeping their current order.
+
+Revision ID: 0006_add_list_indexes
+Revises: 0005_lowercase_user_emails
+Create Date: 2026-10-15
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006_add_list_indexes"
+down_revision = "0005_lowercase_user_emails"
+branch_labels = None
+depends_on = None
+
+
+def _renumber_duplicate_positions() -> None:
+    bind = op.get_bind()
+    rows = bind.execute(sa.text(
+        "SELECT id, session_id FROM relay_entries WHERE session_id IN ("
+        "SELECT session_id FROM relay_entries "
+        "GROUP BY session_id, position HAVING count(*) > 1) "
+        "ORDER BY session_id, position, id"
+    )).all()
+    updates = []
+    session_id, position = None, 0
+    for row in rows:
+        if row.session_id != session_id:
+            session_id, position = row.session_id, 0
+        position += 1
+        updates.append({"entry_id": row.id, "position": position})
+    if updates:
+        bind.execute(
+            sa.text("UPDATE relay_entries SET position = :position WHERE id = :entry_id"),
+            updates,
+        )
+
+
+def upgrade() -> None:
+    # Ascending indexes serve ORDER BY created_at DESC via a backward scan;
+    # id breaks ties for the stash list's (created_at, id) keyset paging.
+    op.create_index(
+        "ix_stashes_user_created", "stashes", ["user_id", "created_at", "id"]
+    )
+    op.create_index(
+        "ix_stashes_collection_created", "stashes", ["collection_id", "created_at", "id"]
+    )
+    _renumber_duplicate_positions()
+    op.create_index(
+        "ix_relay_entries_session_position",
+        "relay_entries",
+        ["session_id", "position"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_relay_entries_session_position", table_name="relay_entries")
+    op.drop_index("ix_stashes_collection_created", table_name="stashes")
+    op.drop_index("ix_stashes_user_created", table_name="stashes")
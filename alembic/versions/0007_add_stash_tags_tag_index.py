@@ -0,0 +1,22 @@
+"""Add a reverse (tag_id, stash_id) index on stash_tags.
+
+Revision ID: 0007_add_stash_tags_tag_index
+Revises: 0006_add_list_indexes
+Create Date: 2026-10-15
+"""
+
+from alembic import op
+
+
+revision = "0007_add_stash_tags_tag_index"
+down_revision = "0006_add_list_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_stash_tags_tag_stash", "stash_tags", ["tag_id", "stash_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_stash_tags_tag_stash", table_name="stash_tags")
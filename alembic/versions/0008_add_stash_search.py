@@ -0,0 +1,80 @@
+"""Add full-text search over stash titles and bodies.
+
+SQLite gets an external-content FTS5 table kept in sync by triggers;
+PostgreSQL gets a GIN index on the tsvector expression used by search.
+
+The FTS5 table is keyed by a new integer column, stashes.search_rowid, not
+by the implicit rowid: stashes has a string primary key, so VACUUM and table
+copies may renumber its rowids. Existing rows take their current rowid and
+the insert trigger numbers new ones. Later migrations that copy the stashes
+table (batch_alter_table on SQLite) drop its triggers and must recreate them.
+
+Revision ID: 0008_add_stash_search
+Revises: 0007_add_stash_tags_tag_index
+Create Date: 2026-10-15
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008_add_stash_search"
+down_revision = "0007_add_stash_tags_tag_index"
+branch_labels = None
+depends_on = None
+
+SEARCH_DOCUMENT = "coalesce(title, '') || ' ' || coalesce(body, '')"
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    op.add_column("stashes", sa.Column("search_rowid", sa.Integer(), nullable=True))
+    op.create_index("ix_stashes_search_rowid", "stashes", ["search_rowid"], unique=True)
+    if dialect == "sqlite":
+        # Existing rows keep their current rowid as their search key
+        op.execute("UPDATE stashes SET search_rowid = rowid")
+        op.execute(
+            "CREATE VIRTUAL TABLE stash_fts USING fts5("
+            "title, body, content='stashes', content_rowid='search_rowid')"
+        )
+        op.execute(
+            "CREATE TRIGGER stashes_fts_ai AFTER INSERT ON stashes BEGIN "
+            "UPDATE stashes SET search_rowid = "
+            "(SELECT coalesce(max(search_rowid), 0) + 1 FROM stashes) "
+            "WHERE rowid = new.rowid AND new.search_rowid IS NULL; "
+            "INSERT INTO stash_fts(rowid, title, body) "
+            "SELECT search_rowid, title, body FROM stashes WHERE rowid = new.rowid; END"
+        )
+        op.execute(
+            "CREATE TRIGGER stashes_fts_ad AFTER DELETE ON stashes BEGIN "
+            "INSERT INTO stash_fts(stash_fts, rowid, title, body) "
+            "VALUES ('delete', old.search_rowid, old.title, old.body); END"
+        )
+        op.execute(
+            "CREATE TRIGGER stashes_fts_au AFTER UPDATE OF title, body ON stashes BEGIN "
+            "INSERT INTO stash_fts(stash_fts, rowid, title, body) "
+            "VALUES ('delete', old.search_rowid, old.title, old.body); "
+            "INSERT INTO stash_fts(rowid, title, body) "
+            "VALUES (new.search_rowid, new.title, new.body); END"
+        )
+        # Index the stashes that already exist
+        op.execute("INSERT INTO stash_fts(stash_fts) VALUES ('rebuild')")
+    elif dialect == "postgresql":
+        op.execute(
+            "CREATE INDEX ix_stashes_search ON stashes "
+            f"USING gin (to_tsvector('english', {SEARCH_DOCUMENT}))"
+        )
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        op.execute("DROP TRIGGER IF EXISTS stashes_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS stashes_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS stashes_fts_ai")
+        op.execute("DROP TABLE IF EXISTS stash_fts")
+    elif dialect == "postgresql":
+        op.drop_index("ix_stashes_search", table_name="stashes")
+    op.drop_index("ix_stashes_search_rowid", table_name="stashes")
+    with op.batch_alter_table("stashes") as batch_op:
+        batch_op.drop_column("search_rowid")
@@ -0,0 +1,27 @@
+"""Require relay session codes to be stored uppercase.
+
+Revision ID: 0009_relay_code_uppercase_check
+Revises: 0008_add_stash_search
+Create Date: 2026-10-15
+"""
+
+from alembic import op
+
+
+revision = "0009_relay_code_uppercase_check"
+down_revision = "0008_add_stash_search"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Lookups uppercase the requested code and probe the unique index, so
+    # any older mixed-case rows must be normalized before the check applies.
+    op.execute("UPDATE relay_sessions SET code = upper(code) WHERE code <> upper(code)")
+    with op.batch_alter_table("relay_sessions") as batch_op:
+        batch_op.create_check_constraint("ck_relay_sessions_code_upper", "code = upper(code)")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("relay_sessions") as batch_op:
+        batch_op.drop_constraint("ck_relay_sessions_code_upper", type_="check")
@@ -0,0 +1,26 @@
+"""Record when a password reset link was last sent.
+
+Login skips re-hashing a password while a reset link may still be unused,
+since reset links are signed against the current hash.
+
+Revision ID: 0010_add_password_reset_sent_at
+Revises: 0009_relay_code_uppercase_check
+Create Date: 2026-10-15
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010_add_password_reset_sent_at"
+down_revision = "0009_relay_code_uppercase_check"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("users", sa.Column("password_reset_sent_at", sa.DateTime()))
+
+
+def downgrade() -> None:
+    op.drop_column("users", "password_reset_sent_at")
@@ -4,17 +4,65 @@ Ruff - A Flask-based text stashing application.
 A simple and elegant way to save, organize, and manage text snippets.
 """
 
-import json
+import atexit
+import copy
 import logging
 import logging.handlers
 import os
-import uuid
-from flask import Flask, render_template, g, request, has_request_context
+import queue
+import sys
+import time
+from flask import Flask, flash, redirect, render_template, g, request, session, has_request_context, url_for
+from flask.json.provider import DefaultJSONProvider
 
+from auth_utils import SmtpConfig
 from config import get_config
 from sockets import init_socketio
 from routes import bp, csrf, limiter
 from models import db
+from utils import json_dumps, orjson, uuid4_str
+
+# Background listener that drains log records off the request threads
+_log_listener = None
+_LOGS_DIR_READY = False
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider that parses and serializes with orjson.
+
+    Dates still go through the default provider's handler, so responses
+    keep Flask's HTTP-date format.
+    """
+
+    def _options(self, sort_keys: bool, indent: bool = False) -> int:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs) -> str:
+        option = self._options(kwargs.get("sort_keys", self.sort_keys))
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        # Hooks such as the session serializer's object_hook need the stdlib.
+        # orjson.JSONDecodeError is a ValueError, which request.get_json handles.
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        body = orjson.dumps(
+            obj,
+            default=self.default,
+            option=self._options(self.sort_keys, indent),
+        )
+        return self._app.response_class(body, mimetype=self.mimetype)
 
 
 def create_app(config_name: str = None) -> Flask:
@@ -28,10 +76,18 @@ def create_app(config_name: str = None) -> Flask:
         Configured Flask application instance
     """
     app = Flask(__name__)
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
     
     # Load configuration
     config = get_config(config_name)
     app.config.from_object(config)
+
+    # Snapshot SMTP settings once instead of reading config per email
+    app.extensions["smtp_cfg"] = SmtpConfig.from_config(app.config)
+
+    # user_id -> (expires_at, choices); see routes.get_collection_choices
+    app.extensions["collection_choices"] = {}
     
     # Initialize database
     db.init_app(app)
@@ -51,7 +107,7 @@ def create_app(config_name: str = None) -> Flask:
     # Request ID + structured logging context
     @app.before_request
     def add_request_id():
-        req_id = request.headers.get("X-Request-ID") or str(uuid.uuid4())
+        req_id = request.headers.get("X-Request-ID") or uuid4_str()
         g.request_id = req_id
         # Attach to WSGI environ for access logs if desired
         request.environ["request_id"] = req_id
@@ -84,34 +140,54 @@ def setup_logging(app: Flask) -> None:
     Args:
         app: Flask application instance
     """
+    global _log_listener, _LOGS_DIR_READY
+
     root_logger = logging.getLogger()
     if any(getattr(handler, "ruff_handler", False) for handler in root_logger.handlers):
+        app.extensions["log_listener"] = _log_listener
         return
     
-    # Create logs directory if it doesn't exist
-    logs_dir = os.path.join(os.path.dirname(__file__), "logs")
-    if not os.path.exists(logs_dir):
-        os.makedirs(logs_dir)
-    
-    # File handler for all logs
-    file_handler = logging.handlers.RotatingFileHandler(
-        os.path.join(logs_dir, "ruff.log"),
-        maxBytes=10485760,  # 10MB
-        backupCount=10,
-    )
-    file_handler.setLevel(logging.INFO)
-    file_handler.ruff_handler = True
-    
-    # Console handler for development
-    console_handler = logging.StreamHandler()
+    # Console handler; in stdout mode it is the only handler and the
+    # platform (systemd, Kubernetes, ...) owns collection and rotation
+    log_to_stdout = app.config.get("LOG_TO_STDOUT", True)
+    console_handler = logging.StreamHandler(sys.stdout if log_to_stdout else None)
     console_handler.setLevel(logging.DEBUG if app.debug else logging.INFO)
-    console_handler.ruff_handler = True
+    handlers = [console_handler]
+
+    file_handler = None
+    if not log_to_stdout:
+        # Create logs directory once per process
+        logs_dir = os.path.join(os.path.dirname(__file__), "logs")
+        if not _LOGS_DIR_READY:
+            os.makedirs(logs_dir, exist_ok=True)
+            _LOGS_DIR_READY = True
+
+        # File handler for all logs; rotation is left to logrotate, so
+        # emit() never rolls the file over while holding the handler lock
+        file_handler = logging.handlers.WatchedFileHandler(
+            os.path.join(logs_dir, "ruff.log"),
+        )
+        file_handler.setLevel(logging.INFO)
+        handlers.append(file_handler)
     
     # Create formatters
-    class JsonFormatter(logging.Formatter):
+    class CachedTimeFormatter(logging.Formatter):
+        """Formatter that reuses the rendered timestamp within a second."""
+
+        _last_ts_int = None
+        _last_ts_str = ""
+
+        def formatTime(self, record, datefmt=None):
+            ts_int = int(record.created)
+            if ts_int != self._last_ts_int:
+                self._last_ts_str = time.strftime("%Y-%m-%d %H:%M:%S", self.converter(ts_int))
+                self._last_ts_int = ts_int
+            return f"{self._last_ts_str},{int(record.msecs):03d}"
+
+    class JsonFormatter(CachedTimeFormatter):
         def format(self, record):
             payload = {
-                "ts": self.formatTime(record, self.datefmt),
+                "ts": self.formatTime(record),
                 "level": record.levelname,
                 "logger": record.name,
                 "request_id": getattr(record, "request_id", "-"),
@@ -119,28 +195,28 @@ def setup_logging(app: Flask) -> None:
             }
             if record.exc_info:
                 payload["exc_info"] = self.formatException(record.exc_info)
-            return json.dumps(payload)
+            elif record.exc_text:
+                payload["exc_info"] = record.exc_text
+            return json_dumps(payload)
 
-    class ConsoleFormatter(logging.Formatter):
+    class ConsoleFormatter(CachedTimeFormatter):
         def format(self, record):
             base = (
-                f"{self.formatTime(record, self.datefmt)} | "
+                f"{self.formatTime(record)} | "
                 f"{record.levelname:<7} | {record.name} | "
                 f"{getattr(record, 'request_id', '-')}"
                 f" | {record.getMessage()}"
             )
             if record.exc_info:
                 base += "\n" + self.formatException(record.exc_info)
+            elif record.exc_text:
+                base += "\n" + record.exc_text
             return base
 
-    file_handler.setFormatter(JsonFormatter())
     console_handler.setFormatter(ConsoleFormatter())
-    
-    # Add handlers to logger
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
-    root_logger.setLevel(logging.DEBUG if app.debug else logging.INFO)
-    
+    if file_handler is not None:
+        file_handler.setFormatter(JsonFormatter())
+
     # Inject request_id into log records
     class RequestIdFilter(logging.Filter):
         def filter(self, record):
@@ -149,9 +225,39 @@ def setup_logging(app: Flask) -> None:
             else:
                 record.request_id = "-"
             return True
-    req_filter = RequestIdFilter()
-    file_handler.addFilter(req_filter)
-    console_handler.addFilter(req_filter)
+
+    class RequestQueueHandler(logging.handlers.QueueHandler):
+        """Queue handler that keeps tracebacks separate from the message."""
+
+        def prepare(self, record):
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            return record
+
+    # Formatting and I/O run on the listener thread; only the request_id
+    # lookup has to happen on the request thread, so the filter sits on
+    # the queue handler.
+    log_queue = queue.SimpleQueue()
+    queue_handler = RequestQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.ruff_handler = True
+
+    _log_listener = logging.handlers.QueueListener(
+        log_queue,
+        *handlers,
+        respect_handler_level=True,
+    )
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    app.extensions["log_listener"] = _log_listener
+
+    # Add handler to logger
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(logging.DEBUG if app.debug else logging.INFO)
 
 
 def register_error_handlers(app: Flask) -> None:
@@ -162,21 +268,43 @@ def register_error_handlers(app: Flask) -> None:
         app: Flask application instance
     """
     logger = logging.getLogger(__name__)
+    pages = app.extensions.setdefault("error_pages", {})
+
+    def render_error_page(code: int) -> str:
+        # Error pages only vary with the signed-in user and flashed messages,
+        # so anonymous renders are kept and reused until the app restarts.
+        if app.debug or g.get("user") is not None or session.get("_flashes"):
+            return render_template(f"errors/{code}.html")
+        key = (code, request.script_root)
+        page = pages.get(key)
+        if page is None:
+            page = pages[key] = render_template(f"errors/{code}.html")
+        return page
 
     @app.errorhandler(404)
     def not_found_error(error):
         """Handle 404 errors."""
         logger.warning(f"404 error: {error}")
-        return render_template("errors/404.html"), 404
+        return render_error_page(404), 404
 
     @app.errorhandler(500)
     def internal_error(error):
         """Handle 500 errors."""
         logger.error(f"500 error: {error}")
-        return render_template("errors/500.html"), 500
+        return render_error_page(500), 500
+
+    @app.errorhandler(413)
+    def request_too_large_error(error):
+        """Handle uploads over MAX_CONTENT_LENGTH."""
+        logger.warning(f"413 error: {error}")
+        if request.endpoint == "main.import_data":
+            limit_mb = app.config["MAX_CONTENT_LENGTH"] / (1024 * 1024)
+            flash(f"Import file is too large (limit {limit_mb:g} MB).", "error")
+            return redirect(url_for("main.import_data"))
+        return error
 
     @app.errorhandler(400)
     def bad_request_error(error):
         """Handle 400 errors."""
         logger.warning(f"400 error: {error}")
-        return render_template("errors/400.html"), 400
+        return render_error_page(400), 400
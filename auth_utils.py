@@ -2,9 +2,15 @@
 Authentication helpers: token generation and email sending.
 """
 
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Mapping, Optional, Tuple
+import atexit
+import hmac
 import logging
 import smtplib
+import threading
+import time
 from email.message import EmailMessage
 
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
@@ -14,20 +20,65 @@ from models import db, User
 
 logger = logging.getLogger(__name__)
 
+# Guards creating each app's email pool on first use
+_email_pool_lock = threading.Lock()
+
+# One reusable SMTP connection per email worker thread
+_smtp_local = threading.local()
+
+# Serializers keyed by (SECRET_KEY, SECURITY_PASSWORD_SALT) so the signing
+# keys are derived once per configuration rather than on every token op.
+_serializer_cache: Dict[Tuple[str, str], URLSafeTimedSerializer] = {}
+
+# Tokens for these purposes carry the password hash, so changing the password
+# invalidates them. Verification links don't, so a re-hash can't break them.
+_HASH_BOUND_PURPOSES = frozenset({"password_reset"})
+
+
+@dataclass(frozen=True)
+class SmtpConfig:
+    """SMTP settings snapshotted from the app config at startup."""
+
+    host: str
+    port: int
+    user: str
+    password: str
+    from_addr: str
+    use_tls: bool
+    use_ssl: bool
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> "SmtpConfig":
+        """Build SMTP settings from a Flask config mapping."""
+        return cls(
+            host=config.get("SMTP_HOST") or "",
+            port=config.get("SMTP_PORT", 587),
+            user=config.get("SMTP_USER") or "",
+            password=config.get("SMTP_PASSWORD") or "",
+            from_addr=config.get("SMTP_FROM") or "",
+            use_tls=config.get("SMTP_USE_TLS", True),
+            use_ssl=config.get("SMTP_USE_SSL", False),
+        )
+
 
 def _serializer() -> URLSafeTimedSerializer:
-    return URLSafeTimedSerializer(
+    key = (
         current_app.config["SECRET_KEY"],
-        salt=current_app.config["SECURITY_PASSWORD_SALT"],
+        current_app.config["SECURITY_PASSWORD_SALT"],
     )
+    serializer = _serializer_cache.get(key)
+    if serializer is None:
+        serializer = _serializer_cache[key] = URLSafeTimedSerializer(key[0], salt=key[1])
+    return serializer
 
 
 def generate_token(user: User, purpose: str) -> str:
     payload = {
         "user_id": user.id,
         "purpose": purpose,
-        "pw": user.password_hash,
     }
+    if purpose in _HASH_BOUND_PURPOSES:
+        payload["pw"] = user.password_hash
     return _serializer().dumps(payload)
 
 
@@ -39,53 +90,129 @@ def verify_token(token: str, purpose: str, max_age: int) -> Tuple[Optional[User]
     except BadSignature:
         return None, "invalid"
 
-    if data.get("purpose") != purpose:
+    if not hmac.compare_digest(str(data.get("purpose", "")).encode(), purpose.encode()):
         return None, "invalid"
 
     user = db.session.get(User, data.get("user_id"))
     if user is None:
         return None, "invalid"
-
-    if data.get("pw") != user.password_hash:
-        return None, "invalid"
+    if purpose in _HASH_BOUND_PURPOSES:
+        token_pw = str(data.get("pw", ""))
+        if not hmac.compare_digest(token_pw.encode(), user.password_hash.encode()):
+            return None, "invalid"
 
     return user, None
 
 
 def send_email(recipient: str, subject: str, body: str) -> None:
     """
-    Send email via SMTP if configured; otherwise log and return.
+    Queue an email for background delivery via SMTP if configured;
+    otherwise log and return.
     """
-    host = current_app.config.get("SMTP_HOST")
-    from_addr = current_app.config.get("SMTP_FROM")
+    cfg = current_app.extensions["smtp_cfg"]
 
-    if not host or not from_addr:
+    if not cfg.host or not cfg.from_addr:
         logger.warning("SMTP not configured. Email to %s | %s | %s", recipient, subject, body)
         return
 
-    port = current_app.config.get("SMTP_PORT", 587)
-    username = current_app.config.get("SMTP_USER")
-    password = current_app.config.get("SMTP_PASSWORD")
-    use_tls = current_app.config.get("SMTP_USE_TLS", True)
-    use_ssl = current_app.config.get("SMTP_USE_SSL", False)
-
+    _email_pool().submit(_send_email_sync, cfg, recipient, subject, body)
+
+
+def _email_pool() -> ThreadPoolExecutor:
+    """Return the app's email pool, sized by EMAIL_WORKERS on first use."""
+    pool = current_app.extensions.get("email_pool")
+    if pool is None:
+        with _email_pool_lock:
+            pool = current_app.extensions.get("email_pool")
+            if pool is None:
+                # SMTP delivery runs off the request thread
+                pool = ThreadPoolExecutor(
+                    max_workers=current_app.config["EMAIL_WORKERS"],
+                    thread_name_prefix="smtp",
+                )
+                atexit.register(pool.shutdown, wait=True)
+                current_app.extensions["email_pool"] = pool
+    return pool
+
+
+class _SmtpClient:
+    """SMTP connection kept open across messages sent from one thread."""
+
+    MAX_IDLE_SECONDS = 300
+    MAX_MESSAGES = 100
+
+    def __init__(self) -> None:
+        self.conn = None
+        self.cfg = None
+        self.sent = 0
+        self.last_used = 0.0
+
+    def _connect(self, cfg: SmtpConfig) -> None:
+        if cfg.use_ssl:
+            conn = smtplib.SMTP_SSL(cfg.host, cfg.port, timeout=10)
+        else:
+            conn = smtplib.SMTP(cfg.host, cfg.port, timeout=10)
+        if cfg.use_tls and not cfg.use_ssl:
+            conn.starttls()
+        if cfg.user and cfg.password:
+            conn.login(cfg.user, cfg.password)
+        self.conn = conn
+        self.cfg = cfg
+        self.sent = 0
+
+    def close(self) -> None:
+        if self.conn is not None:
+            try:
+                self.conn.quit()
+            except Exception:
+                self.conn.close()
+        self.conn = None
+
+    def _is_usable(self, cfg: SmtpConfig) -> bool:
+        if self.conn is None or self.cfg != cfg:
+            return False
+        if self.sent >= self.MAX_MESSAGES:
+            return False
+        if time.monotonic() - self.last_used > self.MAX_IDLE_SECONDS:
+            return False
+        try:
+            return self.conn.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+
+    def send(self, cfg: SmtpConfig, message: EmailMessage) -> None:
+        if not self._is_usable(cfg):
+            self.close()
+            self._connect(cfg)
+        try:
+            self.conn.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self._connect(cfg)
+            self.conn.send_message(message)
+        self.sent += 1
+        self.last_used = time.monotonic()
+
+
+def _smtp_client() -> _SmtpClient:
+    client = getattr(_smtp_local, "client", None)
+    if client is None:
+        client = _smtp_local.client = _SmtpClient()
+    return client
+
+
+def _send_email_sync(cfg: SmtpConfig, recipient: str, subject: str, body: str) -> None:
+    """Deliver one email; runs on the email pool without an app context."""
     message = EmailMessage()
     message["Subject"] = subject
-    message["From"] = from_addr
+    message["From"] = cfg.from_addr
     message["To"] = recipient
     message.set_content(body)
 
+    client = _smtp_client()
     try:
-        if use_ssl:
-            server = smtplib.SMTP_SSL(host, port, timeout=10)
-        else:
-            server = smtplib.SMTP(host, port, timeout=10)
-        with server:
-            if use_tls and not use_ssl:
-                server.starttls()
-            if username and password:
-                server.login(username, password)
-            server.send_message(message)
+        client.send(cfg, message)
         logger.info("Email sent to %s | %s", recipient, subject)
     except Exception as exc:
+        client.close()
         logger.error("Failed to send email to %s: %s", recipient, exc)
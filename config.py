@@ -6,6 +6,31 @@ Loads configuration from environment variables with sensible defaults.
 
 import os
 from datetime import timedelta
+from functools import lru_cache
+
+
+def build_engine_options(database_uri: str) -> dict:
+    """
+    Build SQLAlchemy engine options for the given database URI.
+
+    Args:
+        database_uri: SQLAlchemy database URI
+
+    Returns:
+        Engine options with a sized pool for server databases, or
+        SQLite-safe connect args (SQLite does not take pool sizing).
+    """
+    if database_uri.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        # Pre-ping costs a round trip per checkout; with it off, connections
+        # dropped by the server surface as errors until recycled
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_use_lifo": True,
+    }
 
 
 class Config:
@@ -28,6 +53,14 @@ class Config:
     PASSWORD_RESET_TOKEN_EXP = int(os.getenv("PASSWORD_RESET_TOKEN_EXP", "3600"))  # 1h
     REQUIRE_EMAIL_VERIFICATION = os.getenv("REQUIRE_EMAIL_VERIFICATION", "1") == "1"
 
+    # Password hashing (any werkzeug method, e.g. "pbkdf2:sha256:600000").
+    # Existing hashes are upgraded on the user's next successful login.
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+
+    # Seconds to keep a user's collection dropdown choices in process memory
+    # (0 disables). Other workers may show a stale list until it expires.
+    COLLECTION_CHOICES_TTL = int(os.getenv("COLLECTION_CHOICES_TTL", "300"))
+
     # SMTP Email
     SMTP_HOST = os.getenv("SMTP_HOST", "")
     SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
@@ -36,22 +69,35 @@ class Config:
     SMTP_FROM = os.getenv("SMTP_FROM", "")
     SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "1") == "1"
     SMTP_USE_SSL = os.getenv("SMTP_USE_SSL", "0") == "1"
+    # Background threads that deliver email
+    EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "4"))
     
     # Database Settings
     SQLALCHEMY_DATABASE_URI = os.getenv(
         "DATABASE_URL",
         "sqlite:///./ruff.db"  # Store in project root
     )
+    SQLALCHEMY_ENGINE_OPTIONS = build_engine_options(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Logging: stdout only by default; set to 0 to also write logs/ruff.log
+    LOG_TO_STDOUT = os.getenv("LOG_TO_STDOUT", "1") == "1"
+
     # Rate Limiting
     RATELIMIT_DEFAULT = os.getenv("RATELIMIT_DEFAULT", "200 per day;50 per hour")
     RATELIMIT_STORAGE_URL = os.getenv("RATELIMIT_STORAGE_URL", "memory://")
+    RATELIMIT_STRATEGY = os.getenv("RATELIMIT_STRATEGY", "moving-window")
     
     # Stash Settings
     MAX_STASH_LENGTH = 50000  # Maximum characters per stash
+    # Largest request body accepted (bounds JSON import uploads); Flask answers 413
+    MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(10 * 1024 * 1024)))
     PREVIEW_LENGTH = 100  # Characters to show in preview
     
+    # Make list views raise on any relationship they did not load up front,
+    # so a new lazy load shows up as an error instead of an N+1 query
+    SQLA_RAISELOAD = os.getenv("SQLA_RAISELOAD", "0") == "1"
+
     # CSRF Protection
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = None  # No time limit for CSRF tokens
@@ -61,6 +107,7 @@ class DevelopmentConfig(Config):
     """Development configuration."""
     DEBUG = True
     TESTING = False
+    SQLA_RAISELOAD = True
 
 
 class ProductionConfig(Config):
@@ -74,14 +121,23 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     WTF_CSRF_ENABLED = False
+    SQLA_RAISELOAD = True
+    # scrypt takes ~0.1s per hash, which dominated test time; tests don't
+    # need a strong hash
+    PASSWORD_HASH_METHOD = "pbkdf2:sha256:1000"
     # Use in-memory DB so tests never touch the real data file
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    SQLALCHEMY_ENGINE_OPTIONS = build_engine_options(SQLALCHEMY_DATABASE_URI)
 
 
 def get_config(env: str = None) -> Config:
     """
     Get configuration based on environment.
 
+    Configuration objects are built once per environment name and shared.
+    Settings are read from the environment when this module is imported, so
+    changing environment variables afterwards needs a re-import.
+
     Args:
         env: Environment name (development, production, testing)
         
@@ -90,7 +146,12 @@ def get_config(env: str = None) -> Config:
     """
     if env is None:
         env = os.getenv("FLASK_ENV", "production")
-    
+    return _config_for(env)
+
+
+@lru_cache(maxsize=4)
+def _config_for(env: str) -> Config:
+    """Build and cache the Config instance for env; use get_config instead."""
     config_map = {
         "development": DevelopmentConfig,
         "production": ProductionConfig,
@@ -2,131 +2,200 @@
 Export/Import utilities for Ruff stashes.
 """
 
-import json
-from uuid import uuid4
-from datetime import datetime
-from typing import Dict, List, Any, Optional
-from models import db, User, Stash, Collection, Tag
+from operator import itemgetter
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Any, Optional, Union
+from sqlalchemy import insert, select
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, User, Stash, Collection, Tag, stash_tags
+from utils import format_timestamp, json_dumps, json_loads, uuid4_str
 
 
-def export_user_data(user: User) -> Dict[str, Any]:
-    """
-    Export all user data (stashes, collections, tags) as a dictionary.
-    
-    Args:
-        user: User object to export
-        
-    Returns:
-        Dictionary with exported data
-    """
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_STASHES = 100
+
+_checklist_fields = itemgetter('done', 'text')
+
+# Keeps IN (...) lists well under per-statement bind parameter limits
+IN_CLAUSE_CHUNK = 1000
+
+
+def _chunks(values, size: int = IN_CLAUSE_CHUNK) -> Iterator[List[Any]]:
+    """Split values into lists of at most size items."""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _export_header(user: User) -> Dict[str, Any]:
+    """Build the export document minus its stashes."""
     export_data = {
         'version': '1.0',
-        'exported_at': datetime.utcnow().isoformat(),
+        'exported_at': datetime.utcnow(),
         'user': {
             'username': user.username,
             'email': user.email,
         },
         'collections': [],
-        'stashes': [],
         'tags': [],
     }
     
     # Export collections
-    for collection in user.collections:
+    collections = Collection.query.filter_by(user_id=user.id).all()
+    for collection in collections:
         export_data['collections'].append({
             'id': collection.id,
             'name': collection.name,
             'description': collection.description,
-            'created_at': collection.created_at.isoformat(),
+            'created_at': collection.created_at,
         })
     
     # Export tags used by this user's stashes
-    user_tags = (
-        Tag.query.join(Tag.stashes)
-        .filter(Stash.user_id == user.id)
-        .distinct()
-        .all()
+    # (an IN over stash_tags avoids a DISTINCT across the join)
+    user_tag_ids = (
+        select(stash_tags.c.tag_id)
+        .join(Stash, Stash.id == stash_tags.c.stash_id)
+        .where(Stash.user_id == user.id)
     )
+    user_tags = Tag.query.filter(Tag.id.in_(user_tag_ids)).all()
     for tag in user_tags:
         export_data['tags'].append({
             'id': tag.id,
             'name': tag.name,
-            'created_at': tag.created_at.isoformat(),
+            'created_at': tag.created_at,
         })
     
-    # Export stashes
-    for stash in user.stashes:
-        stash_data = {
-            'id': stash.id,
-            'title': stash.title,
-            'body': stash.body,
-            'checklist': stash.get_checklist(),
-            'preview': stash.preview,
-            'collection_id': stash.collection_id,
-            'collection_name': stash.collection.name if stash.collection else None,
-            'tags': [tag.name for tag in stash.tags],
-            'created_at': stash.created_at.isoformat(),
-            'updated_at': stash.updated_at.isoformat(),
-        }
-        export_data['stashes'].append(stash_data)
+    return export_data
+
+
+def _export_stashes_query(user: User):
+    """Query a user's stashes with tags and collections loaded up front."""
+    return (
+        Stash.query.options(selectinload(Stash.tags), joinedload(Stash.collection))
+        .filter_by(user_id=user.id)
+    )
+
+
+def _stash_export_dict(stash: Stash) -> Dict[str, Any]:
+    """Convert a stash to its export representation."""
+    return {
+        'id': stash.id,
+        'title': stash.title,
+        'body': stash.body,
+        'checklist': stash.get_checklist(),
+        'preview': stash.preview,
+        'collection_id': stash.collection_id,
+        'collection_name': stash.collection.name if stash.collection else None,
+        'tags': [tag.name for tag in stash.tags],
+        'created_at': stash.created_at,
+        'updated_at': stash.updated_at,
+    }
+
+
+def export_user_data(user: User) -> Dict[str, Any]:
+    """
+    Export all user data (stashes, collections, tags) as a dictionary.
     
+    Args:
+        user: User object to export
+        
+    Returns:
+        Dictionary with exported data
+    """
+    export_data = _export_header(user)
+    export_data['stashes'] = [
+        _stash_export_dict(stash) for stash in _export_stashes_query(user)
+    ]
     return export_data
 
 
+def iter_export_json(user: User, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[str]:
+    """
+    Yield the user's export as chunks of a JSON document.
+
+    Stashes are read in batches of batch_size and serialized one at a
+    time, so the whole export is never held in memory at once.
+    """
+    header = json_dumps(_export_header(user))
+    yield header[:-1] + ',"stashes":['
+
+    stashes = _export_stashes_query(user).yield_per(batch_size)
+    # Group stashes into larger chunks so the server isn't asked to write
+    # one small fragment per stash.
+    parts = []
+    for index, stash in enumerate(stashes):
+        parts.append((',\n' if index else '\n') + json_dumps(_stash_export_dict(stash)))
+        if len(parts) >= EXPORT_CHUNK_STASHES:
+            yield ''.join(parts)
+            parts.clear()
+
+    parts.append('\n]}')
+    yield ''.join(parts)
+
+
 def export_to_json(user: User) -> str:
     """Export user data as JSON string."""
-    export_data = export_user_data(user)
-    return json.dumps(export_data, indent=2)
+    return ''.join(iter_export_json(user))
 
 
 def export_stash_to_text(stash: Stash) -> str:
     """Export a single stash as formatted text."""
     title = stash.title or stash.preview
-    text = f"# {title}\n\n"
-    text += f"**Created:** {stash.created_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
-    text += f"**Updated:** {stash.updated_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
-    
+    parts = [
+        f"# {title}\n\n",
+        f"**Created:** {format_timestamp(stash.created_at)}\n",
+        f"**Updated:** {format_timestamp(stash.updated_at)}\n",
+    ]
+
     if stash.collection:
-        text += f"**Collection:** {stash.collection.name}\n"
-    
-    if len(stash.tags) > 0:
-        tags = [tag.name for tag in stash.tags]
-        text += f"**Tags:** {', '.join(tags)}\n"
+        parts.append(f"**Collection:** {stash.collection.name}\n")
+
+    if stash.tags:
+        tags = ', '.join(tag.name for tag in stash.tags)
+        parts.append(f"**Tags:** {tags}\n")
 
     checklist_items = stash.get_checklist()
     if checklist_items:
-        text += "**Checklist:**\n"
-        for item in checklist_items:
-            mark = "x" if item.get("done") else " "
-            text += f"- [{mark}] {item.get('text')}\n"
-    
-    text += f"\n---\n\n{stash.body}"
-    return text
+        parts.append("**Checklist:**\n")
+        # get_checklist always returns both keys, so no .get() fallback is needed
+        for done, item_text in map(_checklist_fields, checklist_items):
+            mark = "x" if done else " "
+            parts.append(f"- [{mark}] {item_text}\n")
 
+    parts.append(f"\n---\n\n{stash.body}")
+    return "".join(parts)
 
-def import_from_json(user: User, json_data: str) -> Dict[str, Any]:
+
+def import_from_json(user: User, json_data: Union[str, bytes]) -> Dict[str, Any]:
     """
     Import stashes, collections, and tags from JSON.
     
     Args:
         user: User to import data for
-        json_data: JSON string with exported data
+        json_data: Exported JSON document, as text or UTF-8 bytes
         
     Returns:
         Dictionary with import results
     """
     def _parse_datetime(value: Any) -> Optional[datetime]:
         """Best-effort ISO8601 parser that returns None on failure."""
-        if not value:
+        if not value or not isinstance(value, str):
             return None
+        # fromisoformat only accepts a trailing "Z" from Python 3.11 onwards
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
         try:
-            return datetime.fromisoformat(value)
-        except Exception:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
             return None
+        if parsed.tzinfo is not None:
+            # Columns store naive UTC
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
 
     try:
-        data = json.loads(json_data)
-    except json.JSONDecodeError as e:
+        data = json_loads(json_data)
+    except ValueError as e:
         return {
             'success': False,
             'error': f'Invalid JSON: {str(e)}',
@@ -141,101 +210,139 @@ def import_from_json(user: User, json_data: str) -> Dict[str, Any]:
     }
     
     try:
-        # Import collections
-        collection_map = {}  # Map old IDs to new IDs
-        for col_data in data.get('collections', []):
-            existing = Collection.query.filter_by(
-                user_id=user.id,
-                name=col_data['name']
-            ).first()
-            
-            if existing:
-                collection_map[col_data['id']] = existing.id
+        collections_data = data.get('collections', [])
+        tags_data = data.get('tags', [])
+        stashes_data = data.get('stashes', [])
+
+        # Import collections, resolving existing names in one query
+        collection_names = {col_data['name'] for col_data in collections_data}
+        collection_names.update(
+            stash_data['collection_name']
+            for stash_data in stashes_data
+            if stash_data.get('collection_name')
+        )
+        collection_ids = {}  # Map collection names to IDs
+        for names in _chunks(collection_names):
+            collection_ids.update(
+                db.session.query(Collection.name, Collection.id).filter(
+                    Collection.user_id == user.id,
+                    Collection.name.in_(names),
+                )
+            )
+
+        collection_map = {}  # Map old IDs to collection names
+        new_collections = {}  # Rows to create, keyed by name
+        for col_data in collections_data:
+            name = col_data['name']
+            collection_map[col_data['id']] = name
+            if name in collection_ids or name in new_collections:
                 results['skipped']['collections'] += 1
             else:
-                new_col = Collection(
-                    user_id=user.id,
-                    name=col_data['name'],
-                    description=col_data.get('description'),
-                )
-                db.session.add(new_col)
-                db.session.flush()
-                collection_map[col_data['id']] = new_col.id
+                new_collections[name] = {
+                    'user_id': user.id,
+                    'name': name,
+                    'description': col_data.get('description'),
+                }
                 results['created']['collections'] += 1
-        
-        # Import tags
-        tag_map = {}  # Map tag names to tag objects
-        for tag_data in data.get('tags', []):
-            existing = Tag.query.filter_by(name=tag_data['name']).first()
-            
-            if existing:
-                tag_map[tag_data['name']] = existing
+
+        # Import tags, resolving existing names in one query
+        tag_names = {tag_data['name'] for tag_data in tags_data}
+        tag_ids = {}  # Map tag names to tag IDs
+        for names in _chunks(tag_names):
+            tag_ids.update(
+                db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(names)).all()
+            )
+        new_tag_names = {}  # Ordered set of names to create
+        for tag_data in tags_data:
+            if tag_data['name'] in tag_ids or tag_data['name'] in new_tag_names:
                 results['skipped']['tags'] += 1
             else:
-                new_tag = Tag(name=tag_data['name'])
-                db.session.add(new_tag)
-                db.session.flush()
-                tag_map[tag_data['name']] = new_tag
+                new_tag_names[tag_data['name']] = None
                 results['created']['tags'] += 1
-        
-        # Import stashes
-        for stash_data in data.get('stashes', []):
+
+        # New collections and tags go in with one executemany each, then
+        # their IDs are read back by name
+        if new_collections:
+            db.session.execute(insert(Collection), list(new_collections.values()))
+            for names in _chunks(new_collections):
+                collection_ids.update(
+                    db.session.query(Collection.name, Collection.id).filter(
+                        Collection.user_id == user.id,
+                        Collection.name.in_(names),
+                    )
+                )
+        if new_tag_names:
+            db.session.execute(insert(Tag), [{'name': name} for name in new_tag_names])
+            for names in _chunks(new_tag_names):
+                tag_ids.update(
+                    db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(names)).all()
+                )
+
+        # Look up which incoming stash IDs are already taken, and by whom
+        incoming_ids = {stash_data['id'] for stash_data in stashes_data}
+        taken_ids = {}
+        for ids in _chunks(incoming_ids):
+            taken_ids.update(
+                db.session.query(Stash.id, Stash.user_id)
+                .filter(Stash.id.in_(ids))
+                .all()
+            )
+
+        stash_rows = []
+        stash_tag_rows = []
+        now = datetime.utcnow()
+        for stash_data in stashes_data:
             # If this user already has the stash ID, skip
-            existing_same_user = Stash.query.filter_by(
-                user_id=user.id,
-                id=stash_data['id']
-            ).first()
-            if existing_same_user:
+            owner_id = taken_ids.get(stash_data['id'])
+            if owner_id == user.id:
                 results['skipped']['stashes'] += 1
                 continue
 
             # If the ID exists globally for another user, mint a new one
-            existing_any = db.session.get(Stash, stash_data['id'])
-            stash_id = stash_data['id'] if existing_any is None else str(uuid4())
+            stash_id = stash_data['id'] if owner_id is None else uuid4_str()
+            taken_ids[stash_id] = user.id
 
             # Map collection ID
             collection_id = None
             if stash_data.get('collection_id'):
-                collection_id = collection_map.get(stash_data['collection_id'])
+                collection_name = collection_map.get(stash_data['collection_id'])
+                collection_id = collection_ids.get(collection_name)
             elif stash_data.get('collection_name'):
-                col = Collection.query.filter_by(
-                    user_id=user.id,
-                    name=stash_data['collection_name']
-                ).first()
-                if col:
-                    collection_id = col.id
-            
+                collection_id = collection_ids.get(stash_data['collection_name'])
+
             checklist_items = stash_data.get('checklist')
             if not isinstance(checklist_items, list):
                 checklist_items = []
 
-            new_stash = Stash(
-                id=stash_id,
-                user_id=user.id,
-                title=stash_data.get('title'),
-                body=stash_data.get('body') or stash_data.get('text') or "",
-                checklist=checklist_items,
-                collection_id=collection_id,
-            )
-            db.session.add(new_stash)
-            db.session.flush()
-            
-            # Restore timestamps when present (parse strings to datetime)
-            created_at = _parse_datetime(stash_data.get('created_at'))
-            updated_at = _parse_datetime(stash_data.get('updated_at'))
-            if created_at:
-                new_stash.created_at = created_at
-            if updated_at:
-                new_stash.updated_at = updated_at
-            
+            title = stash_data.get('title')
+            body = stash_data.get('body') or stash_data.get('text') or ""
+            created_at = _parse_datetime(stash_data.get('created_at')) or now
+            updated_at = _parse_datetime(stash_data.get('updated_at')) or now
+            stash_rows.append({
+                'id': stash_id,
+                'user_id': user.id,
+                'title': title.strip() if isinstance(title, str) and title.strip() else None,
+                'body': body,
+                'checklist': Stash.encode_checklist(checklist_items),
+                'collection_id': collection_id,
+                'created_at': created_at,
+                'updated_at': updated_at,
+            })
+
             # Add tags
+            stash_tag_ids = set()
             for tag_name in stash_data.get('tags', []):
-                tag = tag_map.get(tag_name)
-                if tag:
-                    new_stash.tags.append(tag)
-            
+                tag_id = tag_ids.get(tag_name)
+                if tag_id and tag_id not in stash_tag_ids:
+                    stash_tag_ids.add(tag_id)
+                    stash_tag_rows.append({'stash_id': stash_id, 'tag_id': tag_id})
+
             results['created']['stashes'] += 1
-        
+
+        Stash.bulk_create(stash_rows)
+        if stash_tag_rows:
+            db.session.execute(insert(stash_tags), stash_tag_rows)
+
         db.session.commit()
         return results
     
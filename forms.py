@@ -7,10 +7,12 @@ from wtforms import TextAreaField, SubmitField, StringField, SelectField, Passwo
 from wtforms.validators import DataRequired, Length, Optional, ValidationError, Email, EqualTo
 from config import get_config
 from models import User
-from sqlalchemy import func
 
 config = get_config()
 
+MAX_STASH_LENGTH = config.MAX_STASH_LENGTH
+BODY_LENGTH_MESSAGE = f"Body must be between 1 and {MAX_STASH_LENGTH} characters."
+
 
 class StashForm(FlaskForm):
     """Form for creating a new stash."""
@@ -29,8 +31,8 @@ class StashForm(FlaskForm):
             DataRequired(message="Please enter some content."),
             Length(
                 min=1,
-                max=config.MAX_STASH_LENGTH,
-                message=f"Body must be between 1 and {config.MAX_STASH_LENGTH} characters.",
+                max=MAX_STASH_LENGTH,
+                message=BODY_LENGTH_MESSAGE,
             ),
         ],
     )
@@ -61,8 +63,8 @@ class EditStashForm(FlaskForm):
             DataRequired(message="Please enter some content."),
             Length(
                 min=1,
-                max=config.MAX_STASH_LENGTH,
-                message=f"Body must be between 1 and {config.MAX_STASH_LENGTH} characters.",
+                max=MAX_STASH_LENGTH,
+                message=BODY_LENGTH_MESSAGE,
             ),
         ],
     )
@@ -150,7 +152,7 @@ class SignupForm(FlaskForm):
     def validate_email(self, field):
         """Check if email is already registered."""
         email = field.data.strip().lower()
-        if User.query.filter(func.lower(User.email) == email).first():
+        if User.query.filter_by(email=email).first():
             raise ValidationError("Email already registered.")
 
 
@@ -3,10 +3,13 @@ Database initialization and migration utilities.
 
 Use this script to:
 1. Initialize a fresh database
+2. Rebuild the SQLite search index after a VACUUM
 """
 
+from sqlalchemy import func, text
+
 from app import create_app
-from models import db, Stash
+from models import STASH_FTS_SQLITE_REBUILD, _has_stash_fts, db, Stash
 
 
 def init_database():
@@ -34,13 +37,28 @@ def clear_database():
             print("✗ Cancelled.")
 
 
+def rebuild_search_index():
+    """Rebuild the SQLite search index from the stashes table."""
+    app = create_app()
+    
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite' or not _has_stash_fts(db.engine):
+            print("✗ No SQLite search index to rebuild.")
+            return
+        db.session.execute(text(STASH_FTS_SQLITE_REBUILD))
+        db.session.commit()
+        print("✓ Search index rebuilt!")
+
+
 def show_statistics():
     """Display database statistics."""
     app = create_app()
     
     with app.app_context():
-        stash_count = Stash.query.count()
-        total_chars = sum(len(s.body) for s in Stash.query.all())
+        stash_count, total_chars = db.session.query(
+            func.count(Stash.id),
+            func.coalesce(func.sum(func.length(Stash.body)), 0),
+        ).one()
         
         print("\n" + "="*50)
         print("DATABASE STATISTICS")
@@ -64,11 +82,14 @@ if __name__ == '__main__':
             clear_database()
         elif command == 'stats':
             show_statistics()
+        elif command == 'rebuild-search':
+            rebuild_search_index()
         else:
             print("Usage:")
             print("  python init_db.py init          - Initialize database")
             print("  python init_db.py stats         - Show database statistics")
             print("  python init_db.py clear         - Clear all data (WARNING!)")
+            print("  python init_db.py rebuild-search - Rebuild SQLite search index from stashes")
     else:
         print("Database Utilities")
         print("-" * 50)
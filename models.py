@@ -2,17 +2,53 @@
 Database models for the Ruff application.
 """
 
-from datetime import datetime
-import json
+import re
+import weakref
+from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional, List, Dict
-from uuid import uuid4
+from flask import current_app, g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (
+    DDL,
+    CheckConstraint,
+    delete,
+    event,
+    func,
+    insert,
+    inspect,
+    lambda_stmt,
+    literal,
+    literal_column,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from utils import generate_stash_preview
+from utils import format_timestamp, generate_stash_preview, json_dumps, json_loads, uuid4_str
 
 db = SQLAlchemy()
 
+DEFAULT_PASSWORD_HASH_METHOD = "scrypt"
+
+
+def _password_hash_method() -> str:
+    """Read the password hashing method from app config when available."""
+    try:
+        return current_app.config.get("PASSWORD_HASH_METHOD", DEFAULT_PASSWORD_HASH_METHOD)
+    except RuntimeError:
+        # No app context active
+        return DEFAULT_PASSWORD_HASH_METHOD
+
+
+@lru_cache(maxsize=8)
+def _password_hash_prefix(method: str) -> str:
+    """Return the parameter prefix werkzeug writes for a hashing method."""
+    return generate_password_hash("", method=method).split("$", 1)[0]
+
 
 class User(db.Model):
     """Model for user accounts."""
@@ -25,6 +61,7 @@ class User(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     email_verified = db.Column(db.Boolean, nullable=False, default=False)
     email_verified_at = db.Column(db.DateTime)
+    password_reset_sent_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -35,14 +72,30 @@ class User(db.Model):
     def __repr__(self) -> str:
         """String representation of User."""
         return f'<User {self.username}>'
+
+    @validates('email')
+    def normalize_email(self, key: str, email: str) -> str:
+        """Store emails lowercased so lookups can use the unique index."""
+        return email.strip().lower() if email else email
     
     def set_password(self, password: str) -> None:
         """Hash and set the user password."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=_password_hash_method())
     
     def check_password(self, password: str) -> bool:
         """Verify the user password."""
         return check_password_hash(self.password_hash, password)
+
+    def password_needs_rehash(self) -> bool:
+        """Whether the stored hash was made with a different method or parameters."""
+        prefix = self.password_hash.split("$", 1)[0]
+        return prefix != _password_hash_prefix(_password_hash_method())
+
+    def password_reset_pending(self, max_age: int) -> bool:
+        """Whether a reset link sent within the last max_age seconds may be unused."""
+        if self.password_reset_sent_at is None:
+            return False
+        return datetime.utcnow() - self.password_reset_sent_at < timedelta(seconds=max_age)
     
     def to_dict(self) -> dict:
         """Convert user to dictionary."""
@@ -50,16 +103,53 @@ class User(db.Model):
             'id': self.id,
             'username': self.username,
             'email': self.email,
-            'stash_count': len(self.stashes),
-            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'stash_count': self.stash_count,
+            'created_at': format_timestamp(self.created_at),
         }
 
 
+def _request_tag_cache() -> Dict[str, 'Tag']:
+    """Name -> Tag cache for the current app context (throwaway outside one)."""
+    if not has_app_context():
+        return {}
+    cache = g.get('tag_cache')
+    if cache is None:
+        cache = g.tag_cache = {}
+    return cache
+
+
+def _insert_ignoring_conflicts(model):
+    """INSERT statement for model that skips rows violating a unique key."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(model).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(model).on_conflict_do_nothing()
+    if dialect in ('mysql', 'mariadb'):
+        return insert(model).prefix_with('IGNORE')
+    return insert(model)
+
+
+def normalize_checklist(items) -> List[Dict]:
+    """Coerce checklist items to {"text", "done"} dicts, dropping blank ones."""
+    pairs = (
+        (str(item.get("text", "")).strip(), bool(item.get("done", False)))
+        if isinstance(item, dict)
+        else (str(item).strip(), False)
+        for item in items or ()
+    )
+    return [{"text": text, "done": done} for text, done in pairs if text]
+
+
 # Association table for many-to-many relationship between Stash and Tag
 stash_tags = db.Table(
     'stash_tags',
     db.Column('stash_id', db.String(36), db.ForeignKey('stashes.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tags.id'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tags.id'), primary_key=True),
+    # The primary key leads with stash_id; this covers lookups by tag
+    db.Index('ix_stash_tags_tag_stash', 'tag_id', 'stash_id'),
 )
 
 
@@ -75,7 +165,7 @@ class Collection(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     # Relationship to stashes
-    stashes = db.relationship('Stash', backref='collection', lazy=True)
+    stashes = db.relationship('Stash', back_populates='collection', lazy=True)
     
     __table_args__ = (db.UniqueConstraint('user_id', 'name', name='uq_user_collection_name'),)
     
@@ -89,8 +179,8 @@ class Collection(db.Model):
             'id': self.id,
             'name': self.name,
             'description': self.description,
-            'stash_count': len(self.stashes),
-            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'stash_count': self.stash_count,
+            'created_at': format_timestamp(self.created_at),
         }
 
 
@@ -108,39 +198,119 @@ class Tag(db.Model):
         'Stash',
         secondary=stash_tags,
         backref=db.backref('tags', lazy='selectin'),
-        lazy='selectin'
+        lazy=True
     )
     
     def __repr__(self) -> str:
         """String representation of Tag."""
         return f'<Tag {self.name}>'
     
+    @classmethod
+    def by_name(cls, name: str) -> Optional['Tag']:
+        """Look up a tag by exact name."""
+        # lambda_stmt caches the statement itself, not just its compiled form
+        return db.session.execute(
+            lambda_stmt(lambda: select(Tag).where(Tag.name == name))
+        ).scalar_one_or_none()
+
+    @classmethod
+    def _by_names(cls, names: List[str]) -> List['Tag']:
+        """Fetch the tags whose names are in names."""
+        return db.session.execute(
+            lambda_stmt(lambda: select(Tag).where(Tag.name.in_(names)))
+        ).scalars().all()
+
+    @classmethod
+    def get_or_create_many(cls, names) -> Dict[str, 'Tag']:
+        """
+        Resolve tag names to Tag objects, creating any that are missing.
+
+        Names are lowercased like add_tag does. Existing tags are read in one
+        query and missing ones inserted in one statement that ignores rows a
+        concurrent request created first.
+        """
+        wanted = list(dict.fromkeys(str(name).lower() for name in names))
+        if not wanted:
+            return {}
+
+        # Tags resolved earlier in this request are reused if still persistent
+        cache = _request_tag_cache()
+        tags = {}
+        for name in wanted:
+            tag = cache.get(name)
+            if tag is not None and inspect(tag).persistent:
+                tags[name] = tag
+
+        lookup = [name for name in wanted if name not in tags]
+        if lookup:
+            found = {tag.name: tag for tag in cls._by_names(lookup)}
+            # Only rows that already existed are cached; tags inserted below
+            # would vanish if this transaction rolls back
+            cache.update(found)
+            tags.update(found)
+        missing = [name for name in lookup if name not in tags]
+        if missing:
+            db.session.execute(
+                _insert_ignoring_conflicts(cls),
+                [{'name': name} for name in missing],
+            )
+            tags.update((tag.name, tag) for tag in cls._by_names(missing))
+
+        return {name: tags[name] for name in wanted if name in tags}
+
+    def delete_row(self) -> None:
+        """
+        Delete this tag with a Core DELETE.
+
+        The DELETE bypasses the session, so the object would still look
+        persistent; it is dropped from the request's tag cache so
+        get_or_create_many can't hand it back later in the request.
+        """
+        db.session.execute(delete(Tag).where(Tag.id == self.id))
+        _request_tag_cache().pop(self.name, None)
+
     def to_dict(self) -> dict:
         """Convert tag to dictionary."""
         return {
             'id': self.id,
             'name': self.name,
-            'stash_count': len(self.stashes),
-            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'stash_count': self.stash_count,
+            'created_at': format_timestamp(self.created_at),
         }
 
 
+def _default_preview(context) -> str:
+    """Column default deriving the preview from the body being inserted."""
+    return generate_stash_preview(context.get_current_parameters()['body'])
+
+
 class Stash(db.Model):
     """Model for storing stashes with titles, body, and checklist."""
     
     __tablename__ = 'stashes'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
+    id = db.Column(db.String(36), primary_key=True, default=uuid4_str)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(200))
     body = db.Column(db.Text, nullable=False)
     checklist = db.Column(db.Text)
-    preview = db.Column(db.String(100), nullable=False)
+    preview = db.Column(db.String(100), nullable=False, default=_default_preview)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Stable integer key for the SQLite full-text index, set by its insert
+    # trigger; unused on other databases
+    search_rowid = db.Column(db.Integer, unique=True, index=True)
     
     # Foreign key for collection (optional)
     collection_id = db.Column(db.Integer, db.ForeignKey('collections.id'), nullable=True)
+    # Joined so serializing a list of stashes never loads collections one by one
+    collection = db.relationship('Collection', back_populates='stashes', lazy='joined')
+
+    # List views filter by owner or collection and page by (created_at, id)
+    __table_args__ = (
+        db.Index('ix_stashes_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_stashes_collection_created', 'collection_id', 'created_at', 'id'),
+    )
     
     def __init__(self, body: str, title: Optional[str] = None, checklist=None, **kwargs) -> None:
         """Initialize Stash with auto-generated preview."""
@@ -155,48 +325,104 @@ class Stash(db.Model):
     def __repr__(self) -> str:
         """String representation of Stash."""
         return f'<Stash {self.id}>'
+
+    @classmethod
+    def bulk_create(cls, rows: List[Dict]) -> None:
+        """
+        Insert stashes from plain column dicts in a single executemany.
+
+        No ORM objects are created; missing ids and previews come from the
+        column defaults.
+        """
+        if rows:
+            db.session.execute(insert(cls), rows)
+
+    @classmethod
+    def bulk_delete(cls, stash_ids, user_id: int) -> int:
+        """
+        Delete the given stashes owned by user_id and return how many went.
+
+        Their tag links are removed first in one statement, since a Core
+        DELETE does not cascade through the tags relationship.
+        """
+        owned = select(cls.id).where(cls.id.in_(stash_ids), cls.user_id == user_id)
+        db.session.execute(
+            delete(stash_tags).where(stash_tags.c.stash_id.in_(owned)),
+            execution_options={'synchronize_session': False},
+        )
+        result = db.session.execute(
+            delete(cls).where(cls.id.in_(stash_ids), cls.user_id == user_id),
+            execution_options={'synchronize_session': 'fetch'},
+        )
+        return result.rowcount
+
+    @classmethod
+    def bulk_move(cls, stash_ids, user_id: int, collection_id: Optional[int]) -> int:
+        """
+        Set the collection of the given stashes owned by user_id in one UPDATE.
+
+        The statement also checks that user_id owns the target collection, so
+        nothing moves (and 0 is returned) when it does not.
+        """
+        stmt = update(cls).where(cls.id.in_(stash_ids), cls.user_id == user_id)
+        if collection_id is not None:
+            stmt = stmt.where(
+                select(Collection.id)
+                .where(Collection.id == collection_id, Collection.user_id == user_id)
+                .exists()
+            )
+        result = db.session.execute(
+            stmt.values(collection_id=collection_id),
+            execution_options={'synchronize_session': 'fetch'},
+        )
+        return result.rowcount
     
     def update_preview(self) -> None:
         """Update preview based on current text."""
         self.preview = generate_stash_preview(self.body)
 
     def get_checklist(self) -> List[Dict]:
-        """Return checklist items as a list of dicts."""
-        if not self.checklist:
+        """
+        Return checklist items as a list of dicts.
+
+        The parsed list is cached against the raw column value, so repeated
+        calls only decode again after the checklist changes.
+        """
+        raw = self.checklist
+        cached = getattr(self, '_checklist_cache', None)
+        if cached is not None and cached[0] is raw:
+            return cached[1]
+
+        items = self._parse_checklist(raw)
+        self._checklist_cache = (raw, items)
+        return items
+
+    @staticmethod
+    def _parse_checklist(raw: Optional[str]) -> List[Dict]:
+        """Decode a stored checklist, returning [] for anything unusable."""
+        if not raw:
             return []
         try:
-            data = json.loads(self.checklist)
+            data = json_loads(raw)
         except Exception:
             return []
 
         if not isinstance(data, list):
             return []
 
-        normalized = []
-        for item in data:
-            if isinstance(item, dict):
-                text = str(item.get("text", "")).strip()
-                done = bool(item.get("done", False))
-            else:
-                text = str(item).strip()
-                done = False
-            if text:
-                normalized.append({"text": text, "done": done})
-        return normalized
+        return normalize_checklist(data)
+
+    @staticmethod
+    def encode_checklist(items) -> Optional[str]:
+        """Return the stored JSON form of checklist items, or None if empty."""
+        normalized = normalize_checklist(items)
+        return json_dumps(normalized) if normalized else None
 
     def set_checklist(self, items) -> None:
         """Persist checklist items as JSON."""
-        normalized = []
-        for item in items or []:
-            if isinstance(item, dict):
-                text = str(item.get("text", "")).strip()
-                done = bool(item.get("done", False))
-            else:
-                text = str(item).strip()
-                done = False
-            if text:
-                normalized.append({"text": text, "done": done})
-        self.checklist = json.dumps(normalized) if normalized else None
+        normalized = normalize_checklist(items)
+        self.checklist = json_dumps(normalized) if normalized else None
+        self._checklist_cache = (self.checklist, normalized)
     
     def to_dict(self) -> dict:
         """Convert stash to dictionary."""
@@ -209,24 +435,121 @@ class Stash(db.Model):
             'collection_id': self.collection_id,
             'collection_name': self.collection.name if self.collection else None,
             'tags': [tag.name for tag in self.tags],
-            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'created_at': format_timestamp(self.created_at),
+            'updated_at': format_timestamp(self.updated_at),
         }
-    
+
+    @staticmethod
+    def tag_names_for(stash_ids) -> Dict[str, List[str]]:
+        """Map each stash id to its tag names, read as plain rows."""
+        tag_names: Dict[str, List[str]] = {stash_id: [] for stash_id in stash_ids}
+        ids = list(tag_names)
+        for start in range(0, len(ids), 1000):
+            rows = db.session.execute(
+                select(stash_tags.c.stash_id, Tag.name)
+                .join(Tag, Tag.id == stash_tags.c.tag_id)
+                .where(stash_tags.c.stash_id.in_(ids[start:start + 1000]))
+            )
+            for stash_id, name in rows:
+                tag_names[stash_id].append(name)
+        return tag_names
+
+    @classmethod
+    def list_columns(cls) -> tuple:
+        """Columns read for list views; the body is left in the database."""
+        return (
+            cls.id,
+            cls.title,
+            cls.preview,
+            cls.checklist,
+            cls.collection_id,
+            cls.created_at,
+            cls.updated_at,
+            Collection.name.label('collection_name'),
+        )
+
+    @classmethod
+    def serialize_rows(cls, rows) -> List[dict]:
+        """
+        Convert rows selected with list_columns() to summary dictionaries.
+
+        These have the same keys as to_dict() apart from 'body', and are
+        built without creating Stash objects.
+        """
+        rows = list(rows)
+        tag_names = cls.tag_names_for(row.id for row in rows)
+        return [
+            {
+                'id': row.id,
+                'title': row.title,
+                'checklist': cls._parse_checklist(row.checklist),
+                'preview': row.preview,
+                'collection_id': row.collection_id,
+                'collection_name': row.collection_name,
+                'tags': tag_names[row.id],
+                'created_at': format_timestamp(row.created_at),
+                'updated_at': format_timestamp(row.updated_at),
+            }
+            for row in rows
+        ]
+
     def add_tag(self, tag_input) -> None:
         """Add a tag to this stash. Can accept Tag object or string."""
         # Handle both Tag objects and string names
         if isinstance(tag_input, Tag):
-            tag = tag_input
+            self._link_tags([tag_input])
         else:
-            tag_name = str(tag_input).lower()
-            tag = Tag.query.filter_by(name=tag_name).first()
-            if not tag:
-                tag = Tag(name=tag_name)
-                db.session.add(tag)
-        
-        if tag not in self.tags:
-            self.tags.append(tag)
+            self.add_tags([tag_input])
+
+    def add_tags(self, tag_names) -> None:
+        """Add several tags by name, resolving them in a couple of queries."""
+        self._link_tags(Tag.get_or_create_many(tag_names).values())
+
+    def set_tags(self, tag_names) -> None:
+        """
+        Replace this stash's tags with the given names.
+
+        Only links that actually change are written: stale ones are removed
+        with one DELETE and new ones added with one insert-or-ignore.
+        """
+        tags = list(Tag.get_or_create_many(tag_names).values())
+        if not inspect(self).persistent:
+            self.tags = tags
+            return
+
+        db.session.add_all(tags)
+        db.session.flush()
+        stale = delete(stash_tags).where(stash_tags.c.stash_id == self.id)
+        if tags:
+            stale = stale.where(stash_tags.c.tag_id.not_in([tag.id for tag in tags]))
+        db.session.execute(stale)
+        self._expire_tag_links([])
+        self._link_tags(tags)
+
+    def _link_tags(self, tags) -> None:
+        """
+        Associate tags with this stash.
+
+        Once the stash is persistent, rows go straight into stash_tags with an
+        insert-or-ignore instead of loading and diffing the tags collection.
+        """
+        tags = list(tags)
+        if not tags:
+            return
+        if not inspect(self).persistent:
+            for tag in tags:
+                if tag not in self.tags:
+                    self.tags.append(tag)
+            return
+
+        db.session.add_all(tags)
+        # Flush pending tags and any earlier changes to this stash's tags
+        db.session.flush()
+        db.session.execute(
+            _insert_ignoring_conflicts(stash_tags),
+            [{'stash_id': self.id, 'tag_id': tag.id} for tag in tags],
+        )
+        self._expire_tag_links(tags)
     
     def remove_tag(self, tag_input) -> None:
         """Remove a tag from this stash. Can accept Tag object or string."""
@@ -235,10 +558,161 @@ class Stash(db.Model):
             tag = tag_input
         else:
             tag_name = str(tag_input).lower()
-            tag = Tag.query.filter_by(name=tag_name).first()
-        
-        if tag and tag in self.tags:
-            self.tags.remove(tag)
+            tag = Tag.by_name(tag_name)
+
+        if tag is None:
+            return
+        if not inspect(self).persistent or not inspect(tag).persistent:
+            if tag in self.tags:
+                self.tags.remove(tag)
+            return
+
+        db.session.flush()
+        db.session.execute(
+            delete(stash_tags).where(
+                stash_tags.c.stash_id == self.id,
+                stash_tags.c.tag_id == tag.id,
+            )
+        )
+        self._expire_tag_links([tag])
+
+    def _expire_tag_links(self, tags) -> None:
+        """Drop loaded tag collections made stale by direct stash_tags writes."""
+        db.session.expire(self, ['tags'])
+        for tag in tags:
+            db.session.expire(tag, ['stashes'])
+
+
+# Full-text search. SQLite keeps an FTS5 index in a shadow table fed by
+# triggers; PostgreSQL uses a GIN expression index over the same text.
+# Migration 0008 creates these for existing databases.
+#
+# The SQLite index is keyed by stashes.search_rowid rather than the implicit
+# rowid, which VACUUM and table copies can renumber because the primary key
+# is a string. The insert trigger numbers new rows after the current maximum.
+# Table copies (batch migrations) drop these triggers with the old table, so
+# they must create them again.
+STASH_FTS_SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE stash_fts USING fts5("
+    "title, body, content='stashes', content_rowid='search_rowid')",
+    "CREATE TRIGGER stashes_fts_ai AFTER INSERT ON stashes BEGIN "
+    "UPDATE stashes SET search_rowid = "
+    "(SELECT coalesce(max(search_rowid), 0) + 1 FROM stashes) "
+    "WHERE rowid = new.rowid AND new.search_rowid IS NULL; "
+    "INSERT INTO stash_fts(rowid, title, body) "
+    "SELECT search_rowid, title, body FROM stashes WHERE rowid = new.rowid; END",
+    "CREATE TRIGGER stashes_fts_ad AFTER DELETE ON stashes BEGIN "
+    "INSERT INTO stash_fts(stash_fts, rowid, title, body) "
+    "VALUES ('delete', old.search_rowid, old.title, old.body); END",
+    "CREATE TRIGGER stashes_fts_au AFTER UPDATE OF title, body ON stashes BEGIN "
+    "INSERT INTO stash_fts(stash_fts, rowid, title, body) "
+    "VALUES ('delete', old.search_rowid, old.title, old.body); "
+    "INSERT INTO stash_fts(rowid, title, body) "
+    "VALUES (new.search_rowid, new.title, new.body); END",
+)
+
+
+STASH_FTS_SQLITE_REBUILD = "INSERT INTO stash_fts(stash_fts) VALUES ('rebuild')"
+
+
+def _stash_search_document(table: str = "") -> str:
+    """SQL for the text PostgreSQL indexes and searches, optionally qualified."""
+    prefix = f"{table}." if table else ""
+    return f"coalesce({prefix}title, '') || ' ' || coalesce({prefix}body, '')"
+
+
+STASH_FTS_POSTGRES_DDL = (
+    "CREATE INDEX ix_stashes_search ON stashes "
+    f"USING gin (to_tsvector('english', {_stash_search_document()}))",
+)
+
+for _statement in STASH_FTS_SQLITE_DDL:
+    event.listen(
+        Stash.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite')
+    )
+for _statement in STASH_FTS_POSTGRES_DDL:
+    event.listen(
+        Stash.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql')
+    )
+event.listen(
+    Stash.__table__,
+    'before_drop',
+    DDL("DROP TABLE IF EXISTS stash_fts").execute_if(dialect='sqlite'),
+)
+
+
+# Engines already seen with the FTS table; weak so disposed engines drop out
+_stash_fts_engines = weakref.WeakSet()
+
+
+def _has_stash_fts(engine) -> bool:
+    """
+    Whether the SQLite FTS table exists (it does once 0008 has run).
+
+    Only a positive answer is remembered, so a worker started before the
+    migration starts using the table as soon as it appears.
+    """
+    if engine in _stash_fts_engines:
+        return True
+    if inspect(engine).has_table('stash_fts'):
+        _stash_fts_engines.add(engine)
+        return True
+    return False
+
+
+def stash_search_filter(query: str):
+    """
+    Build a WHERE clause matching stashes whose title or body contain query.
+
+    Uses the database's full-text index when there is one. Every word must
+    match, and on SQLite words also match as prefixes. Other databases, and
+    queries with no words in them, fall back to a substring ILIKE scan.
+    """
+    words = re.findall(r"\w+", query)
+    engine = db.session.get_bind()
+    dialect = engine.dialect.name
+    if words and dialect == 'postgresql':
+        # Same expression as the index so the planner can use it
+        document = literal_column(
+            f"to_tsvector('english', {_stash_search_document('stashes')})"
+        )
+        return document.op('@@')(func.plainto_tsquery(literal_column("'english'"), query))
+    if words and dialect == 'sqlite' and _has_stash_fts(engine):
+        match = " ".join(f'"{word}"*' for word in words)
+        return text(
+            "stashes.search_rowid IN "
+            "(SELECT rowid FROM stash_fts WHERE stash_fts MATCH :stash_match)"
+        ).bindparams(stash_match=match)
+
+    pattern = f"%{query}%"
+    return or_(Stash.title.ilike(pattern), Stash.body.ilike(pattern))
+
+
+# Stash counts are computed in SQL rather than by loading the related rows.
+# They are declared here because they reference Stash, and deferred so they
+# only run when accessed.
+User.stash_count = db.column_property(
+    select(func.count(Stash.id))
+    .where(Stash.user_id == User.id)
+    .correlate_except(Stash)
+    .scalar_subquery(),
+    deferred=True,
+)
+Collection.stash_count = db.column_property(
+    select(func.count(Stash.id))
+    .where(Stash.collection_id == Collection.id)
+    .correlate_except(Stash)
+    .scalar_subquery(),
+    deferred=True,
+)
+Tag.stash_count = db.column_property(
+    select(func.count())
+    .select_from(stash_tags)
+    .where(stash_tags.c.tag_id == Tag.id)
+    .correlate_except(stash_tags)
+    .scalar_subquery(),
+    deferred=True,
+)
 
 
 class RelaySession(db.Model):
@@ -246,7 +720,7 @@ class RelaySession(db.Model):
 
     __tablename__ = "relay_sessions"
 
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
+    id = db.Column(db.String(36), primary_key=True, default=uuid4_str)
     code = db.Column(db.String(8), nullable=False, unique=True, index=True)
     owner_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     title = db.Column(db.String(200), nullable=False)
@@ -256,14 +730,25 @@ class RelaySession(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     closed_at = db.Column(db.DateTime, nullable=True)
 
+    # Codes are stored uppercase so lookups are a plain unique-index probe
+    __table_args__ = (
+        CheckConstraint("code = upper(code)", name="ck_relay_sessions_code_upper"),
+    )
+
+    # Loaded on demand: only relay_view needs the entries, and it asks for them
     entries = db.relationship(
         "RelayEntry",
         backref="session",
-        lazy="selectin",
+        lazy="select",
         cascade="all, delete-orphan",
         order_by="RelayEntry.position",
     )
 
+    @validates('code')
+    def normalize_code(self, key: str, code: str) -> str:
+        """Store relay codes uppercased to satisfy the check constraint."""
+        return code.strip().upper() if code else code
+
     def to_dict(self) -> dict:
         return {
             "id": self.id,
@@ -272,8 +757,8 @@ class RelaySession(db.Model):
             "prompt": self.prompt,
             "is_closed": self.is_closed,
             "max_entries": self.max_entries,
-            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-            "closed_at": self.closed_at.strftime("%Y-%m-%d %H:%M:%S") if self.closed_at else None,
+            "created_at": format_timestamp(self.created_at),
+            "closed_at": format_timestamp(self.closed_at) if self.closed_at else None,
         }
 
 
@@ -289,6 +774,46 @@ class RelayEntry(db.Model):
     position = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
+    # Entries are always read per session in position order, and the unique
+    # index stops two concurrent appends from taking the same position
+    __table_args__ = (
+        db.Index('ix_relay_entries_session_position', 'session_id', 'position', unique=True),
+    )
+
+    @classmethod
+    def append(cls, session_id: str, author_name: str, body: str, max_entries: int) -> bool:
+        """
+        Add an entry at the next position in one INSERT ... SELECT.
+
+        The position is computed by the database in the same statement, and
+        nothing is inserted once the session has max_entries entries. That
+        alone does not serialize concurrent appends outside SQLite: callers
+        lock the relay_sessions row first (see append_relay_entry in routes),
+        and the unique (session_id, position) index rejects any clash left.
+
+        Returns:
+            True if the entry was added, False if the session is full
+        """
+        next_position = func.coalesce(func.max(cls.position), 0) + 1
+        source = (
+            select(
+                literal(session_id),
+                literal(author_name),
+                literal(body),
+                next_position,
+                literal(datetime.utcnow()),
+            )
+            .where(cls.session_id == session_id)
+            .having(func.coalesce(func.max(cls.position), 0) < max_entries)
+        )
+        result = db.session.execute(
+            insert(cls).from_select(
+                ['session_id', 'author_name', 'body', 'position', 'created_at'],
+                source,
+            )
+        )
+        return result.rowcount > 0
+
     def to_dict(self) -> dict:
         return {
             "id": self.id,
@@ -296,5 +821,5 @@ class RelayEntry(db.Model):
             "author_name": self.author_name,
             "body": self.body,
             "position": self.position,
-            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "created_at": format_timestamp(self.created_at),
         }
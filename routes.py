@@ -4,17 +4,22 @@ Route handlers for the Ruff application.
 
 import logging
 import os
-import json
 import secrets
 import string
+import time
 from datetime import datetime
 from functools import wraps
-from flask import Blueprint, render_template, session, redirect, url_for, flash, current_app, request, g, send_file, send_from_directory
+from typing import Optional
+from flask import Blueprint, Response, render_template, session, redirect, url_for, flash, current_app, request, g, send_file, send_from_directory, stream_with_context
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from sqlalchemy import or_, text, func
+from limits import parse_many
+from sqlalchemy import and_, func, literal, null, or_, select, text, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only, raiseload, selectinload
 from io import BytesIO
+from werkzeug.exceptions import RequestEntityTooLarge
 
 from forms import (
     StashForm,
@@ -26,9 +31,10 @@ from forms import (
     ForgotPasswordForm,
     ResetPasswordForm,
 )
-from models import db, Stash, Tag, Collection, User, RelaySession, RelayEntry
-from export_import import export_to_json, export_stash_to_text, import_from_json
+from models import db, Stash, Tag, Collection, User, RelaySession, RelayEntry, normalize_checklist, stash_search_filter, stash_tags
+from export_import import iter_export_json, export_stash_to_text, import_from_json
 from auth_utils import generate_token, verify_token, send_email
+from utils import format_timestamp, json_dumps, json_loads
 
 logger = logging.getLogger(__name__)
 
@@ -39,26 +45,54 @@ _default_limits = [
     for limit in os.getenv("RATELIMIT_DEFAULT", "200 per day;50 per hour").split(";")
     if limit.strip()
 ]
+# Flask-Limiter only takes limit strings and parses them lazily, so a bad
+# RATELIMIT_DEFAULT would otherwise fail every request; reject it at import.
+for _limit in _default_limits:
+    parse_many(_limit)
+_ratelimit_storage = os.getenv("RATELIMIT_STORAGE_URL", "memory://")
+# Redis: fail fast and share one pooled client per worker; fall back to
+# per-process counters if Redis is unreachable rather than erroring requests.
+_ratelimit_on_redis = _ratelimit_storage.startswith(("redis://", "rediss://", "redis+"))
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=_default_limits,
-    storage_uri=os.getenv("RATELIMIT_STORAGE_URL", "memory://"),
+    storage_uri=_ratelimit_storage,
+    storage_options=(
+        {"socket_timeout": 0.05, "max_connections": 64} if _ratelimit_on_redis else {}
+    ),
+    strategy=os.getenv("RATELIMIT_STRATEGY", "moving-window"),
+    in_memory_fallback_enabled=_ratelimit_on_redis,
+    headers_enabled=False,
+    swallow_errors=True,
 )
 
 
 # Health and readiness probes -------------------------------------------------
 @bp.route("/healthz", methods=["GET"])
+@limiter.exempt
 def healthz():
     """Lightweight health check for load balancers."""
     return {"status": "ok"}, 200
 
 
+# A successful DB ping answers probes for this long without another query
+READYZ_CACHE_SECONDS = 2.0
+_readyz_ok_at = float("-inf")
+
+
 @bp.route("/readyz", methods=["GET"])
+@limiter.exempt
 def readyz():
     """Readiness check that validates DB connectivity."""
+    global _readyz_ok_at
+    if time.monotonic() - _readyz_ok_at < READYZ_CACHE_SECONDS:
+        return {"status": "ok"}, 200
     try:
-        # Minimal DB check
-        db.session.execute(text("SELECT 1"))
+        # Minimal DB check, on a connection returned to the pool right away
+        # rather than one the session would hold until teardown
+        with db.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        _readyz_ok_at = time.monotonic()
         return {"status": "ok"}, 200
     except Exception as e:
         logger.error(f"Readiness check failed: {e}")
@@ -66,6 +100,7 @@ def readyz():
 
 
 @bp.route("/sw.js")
+@limiter.exempt
 def service_worker():
     """Serve the service worker at the app root."""
     return send_from_directory(current_app.static_folder, "sw.js")
@@ -75,21 +110,34 @@ def login_required(f):
     """Decorator to require login for a route."""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        # g.user is None when the session's user no longer exists
+        if 'user_id' not in session or g.user is None:
             flash('You must be logged in to access this page.', 'warning')
             return redirect(url_for('main.login'))
         return f(*args, **kwargs)
     return decorated_function
 
 
+# Probes and the service worker never look at the user
+_ANONYMOUS_ENDPOINTS = frozenset({"main.healthz", "main.readyz", "main.service_worker"})
+
+
+_LOGGED_IN_USER_OPTIONS = (load_only(User.id, User.username, User.email_verified),)
+
+
 @bp.before_request
 def load_logged_in_user():
     """Load the logged-in user from session."""
+    if request.endpoint in _ANONYMOUS_ENDPOINTS:
+        # Not reading the session also keeps "Vary: Cookie" off these responses
+        g.user = None
+        return
     user_id = session.get('user_id')
     if user_id is None:
         g.user = None
     else:
-        g.user = db.session.get(User, user_id)
+        # Requests only need these; other columns load on first access
+        g.user = db.session.get(User, user_id, options=_LOGGED_IN_USER_OPTIONS)
         if (
             g.user
             and current_app.config.get("REQUIRE_EMAIL_VERIFICATION", True)
@@ -99,62 +147,242 @@ def load_logged_in_user():
             g.user = None
 
 
-def get_collection_choices():
+def _is_logged_in() -> bool:
+    """exempt_when predicate: logged-in users are redirected away anyway."""
+    # The limiter runs before blueprint hooks; the repeat load in
+    # load_logged_in_user is served from the session identity map.
+    if "user" not in g:
+        load_logged_in_user()
+    return g.user is not None
+
+
+COLLECTION_CHOICES_MAX_USERS = 1024
+
+
+def _collection_choices(user_id: int) -> tuple:
+    """Return (id, name) choices for a user, cached for COLLECTION_CHOICES_TTL."""
+    ttl = current_app.config.get("COLLECTION_CHOICES_TTL", 0)
+    cache = current_app.extensions.setdefault("collection_choices", {})
+    now = time.monotonic()
+    hit = cache.get(user_id)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+
+    rows = db.session.execute(
+        select(Collection.id, Collection.name).where(Collection.user_id == user_id)
+    ).all()
+    choices = tuple((row.id, row.name) for row in rows)
+    if ttl > 0:
+        if len(cache) >= COLLECTION_CHOICES_MAX_USERS:
+            cache.clear()
+        cache[user_id] = (now + ttl, choices)
+    return choices
+
+
+def invalidate_collection_choices(user_id: int) -> None:
+    """Drop cached collection choices after a user's collections change."""
+    current_app.extensions.get("collection_choices", {}).pop(user_id, None)
+    g.pop("collection_choices", None)
+
+
+def get_collection_choices() -> tuple:
     """Get all collections for current user."""
     try:
         if g.user is None:
-            return []
-        return [(c.id, c.name) for c in Collection.query.filter_by(user_id=g.user.id).all()]
+            return ()
+        # Also memoized per request, which covers COLLECTION_CHOICES_TTL=0
+        if "collection_choices" not in g:
+            g.collection_choices = _collection_choices(g.user.id)
+        return g.collection_choices
     except Exception as e:
         logger.error(f"Error fetching collections: {e}")
-        return []
+        return ()
 
 
-def get_user_tags_with_counts(user_id: int):
-    """Return tags for a user with stash counts."""
-    rows = (
-        db.session.query(Tag, func.count(Stash.id))
-        .join(Tag.stashes)
-        .filter(Stash.user_id == user_id)
-        .group_by(Tag.id)
-        .order_by(Tag.name)
-        .all()
+_NO_COLLECTION = ((-1, "-- No Collection --"),)
+
+
+def collection_field_choices() -> tuple:
+    """Choices for a collection select: "no collection" then the user's own."""
+    return _NO_COLLECTION + get_collection_choices()
+
+
+def _tag_counts_query(user_id: int):
+    """Select (id, name, stash_count) for tags on the user's stashes."""
+    return (
+        select(Tag.id, Tag.name, func.count(stash_tags.c.stash_id).label("stash_count"))
+        .select_from(stash_tags)
+        .join(Stash, Stash.id == stash_tags.c.stash_id)
+        .join(Tag, Tag.id == stash_tags.c.tag_id)
+        .where(Stash.user_id == user_id)
+        .group_by(Tag.id, Tag.name)
     )
-    return [
-        {"id": tag.id, "name": tag.name, "stash_count": count}
-        for tag, count in rows
-    ]
 
 
-def get_user_collections_with_counts(user_id: int):
-    """Return collections for a user with stash counts."""
-    rows = (
-        db.session.query(Collection, func.count(Stash.id))
+def _collection_counts_query(user_id: int):
+    """Select the user's collections with their stash counts."""
+    return (
+        select(
+            Collection.id,
+            Collection.name,
+            Collection.description,
+            Collection.created_at,
+            func.count(Stash.id).label("stash_count"),
+        )
         .outerjoin(
             Stash,
             (Stash.collection_id == Collection.id) & (Stash.user_id == user_id),
         )
-        .filter(Collection.user_id == user_id)
-        .group_by(Collection.id)
-        .order_by(Collection.created_at.desc())
-        .all()
+        .where(Collection.user_id == user_id)
+        .group_by(
+            Collection.id,
+            Collection.name,
+            Collection.description,
+            Collection.created_at,
+        )
+    )
+
+
+def _tag_count_dict(row) -> dict:
+    return {"id": row.id, "name": row.name, "stash_count": row.stash_count}
+
+
+def _collection_count_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "name": row.name,
+        "description": row.description,
+        "stash_count": row.stash_count,
+        "created_at": format_timestamp(row.created_at),
+    }
+
+
+def get_user_tags_with_counts(user_id: int):
+    """Return tags for a user with stash counts."""
+    # Plain column rows; the sidebar never needs Tag/Collection objects
+    rows = db.session.execute(_tag_counts_query(user_id).order_by(Tag.name))
+    return [_tag_count_dict(row) for row in rows]
+
+
+def get_user_collections_with_counts(user_id: int):
+    """Return collections for a user with stash counts."""
+    rows = db.session.execute(
+        _collection_counts_query(user_id).order_by(Collection.created_at.desc())
+    )
+    return [_collection_count_dict(row) for row in rows]
+
+
+def get_user_sidebar_counts(user_id: int):
+    """
+    Return (collections, tags) with stash counts from a single query.
+
+    Both lists come back from one UNION ALL round trip and are sorted here
+    the same way the single-purpose helpers above sort them.
+    """
+    tag_counts = _tag_counts_query(user_id).subquery()
+    rows = db.session.execute(
+        union_all(
+            _collection_counts_query(user_id).add_columns(literal("collection").label("kind")),
+            select(
+                tag_counts.c.id,
+                tag_counts.c.name,
+                null(),
+                null(),
+                tag_counts.c.stash_count,
+                literal("tag"),
+            ),
+        )
+    ).all()
+    collections = sorted(
+        (row for row in rows if row.kind == "collection"),
+        key=lambda row: row.created_at,
+        reverse=True,
+    )
+    tags = sorted((row for row in rows if row.kind == "tag"), key=lambda row: row.name)
+    return (
+        [_collection_count_dict(row) for row in collections],
+        [_tag_count_dict(row) for row in tags],
     )
-    return [
-        {
-            "id": collection.id,
-            "name": collection.name,
-            "description": collection.description,
-            "stash_count": count,
-            "created_at": collection.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        }
-        for collection, count in rows
-    ]
+
+
+_RELAY_ALPHABET = (string.ascii_uppercase + string.digits).encode()
+# Largest multiple of the alphabet size that fits in a byte; higher bytes are
+# rejected so every symbol stays equally likely.
+_RELAY_BYTE_LIMIT = 256 - 256 % len(_RELAY_ALPHABET)
 
 
 def generate_relay_code(length: int = 6) -> str:
     """Generate a short uppercase relay code."""
-    alphabet = string.ascii_uppercase + string.digits
-    return "".join(secrets.choice(alphabet) for _ in range(length))
+    code = b""
+    while len(code) < length:
+        # Oversample so one CSPRNG read almost always suffices
+        code += bytes(
+            _RELAY_ALPHABET[b % len(_RELAY_ALPHABET)]
+            for b in secrets.token_bytes(length * 2)
+            if b < _RELAY_BYTE_LIMIT
+        )
+    return code[:length].decode()
+
+
+def clean_tag_names(names) -> list:
+    """Strip and lowercase tag names, dropping blanks and duplicates."""
+    return list(dict.fromkeys(
+        name for name in (str(part).strip().lower() for part in names) if name
+    ))
+
+
+RELAY_CODE_ATTEMPTS = 5
+
+
+def create_relay_session(**fields) -> str:
+    """
+    Insert and commit a relay session under a fresh code, returning the code.
+
+    The unique index on code detects collisions, so the usual case is a
+    single INSERT with no lookup first; a clash just retries with a new code.
+    """
+    for _ in range(RELAY_CODE_ATTEMPTS):
+        code = generate_relay_code()
+        db.session.add(RelaySession(code=code, **fields))
+        try:
+            db.session.commit()
+            return code
+        except IntegrityError:
+            db.session.rollback()
+    raise RuntimeError(f"No free relay code after {RELAY_CODE_ATTEMPTS} attempts")
+
+
+RELAY_APPEND_ATTEMPTS = 3
+
+
+def append_relay_entry(session_id: str, author_name: str, body: str, max_entries: int) -> bool:
+    """
+    Append and commit a relay entry, returning False if the relay is full.
+
+    The caller holds a FOR UPDATE lock on the relay row, so appends to one
+    relay take positions one at a time (SQLite ignores the lock but
+    serializes writes anyway). If two appends still pick the same position,
+    the unique index rejects one and it retries with the lock taken again.
+    """
+    lock_relay = select(RelaySession.id).where(RelaySession.id == session_id).with_for_update()
+    for attempt in range(RELAY_APPEND_ATTEMPTS):
+        if attempt:
+            db.session.execute(lock_relay)
+        try:
+            added = RelayEntry.append(session_id, author_name, body, max_entries)
+        except IntegrityError:
+            db.session.rollback()
+            continue
+        db.session.commit()
+        return added
+    raise RuntimeError(f"No free relay position after {RELAY_APPEND_ATTEMPTS} attempts")
+
+
+def parse_tag_names(raw: str) -> list:
+    """Split a comma-separated tag field into unique lowercase names."""
+    if not raw:
+        return []
+    return clean_tag_names(raw.split(","))
 
 
 def parse_checklist(raw: str):
@@ -162,26 +390,16 @@ def parse_checklist(raw: str):
     if not raw:
         return []
     try:
-        data = json.loads(raw)
+        data = json_loads(raw)
     except Exception:
         return []
     if not isinstance(data, list):
         return []
-    items = []
-    for item in data:
-        if isinstance(item, dict):
-            text = str(item.get("text", "")).strip()
-            done = bool(item.get("done", False))
-        else:
-            text = str(item).strip()
-            done = False
-        if text:
-            items.append({"text": text, "done": done})
-    return items
+    return normalize_checklist(data)
 
 
 @bp.route("/login", methods=["GET", "POST"])
-@limiter.limit("10 per minute")
+@limiter.limit("10 per minute", exempt_when=_is_logged_in)
 def login():
     """Handle user login."""
     if g.user is not None:
@@ -198,6 +416,12 @@ def login():
         if current_app.config.get("REQUIRE_EMAIL_VERIFICATION", True) and not user.email_verified:
             flash("Please verify your email before logging in.", "warning")
             return redirect(url_for("main.resend_verification", email=user.email))
+
+        # A re-hash would invalidate a reset link that is still in the inbox
+        reset_max_age = current_app.config.get("PASSWORD_RESET_TOKEN_EXP", 3600)
+        if user.password_needs_rehash() and not user.password_reset_pending(reset_max_age):
+            user.set_password(form.password.data)
+            db.session.commit()
         
         session.clear()
         session['user_id'] = user.id
@@ -210,7 +434,7 @@ def login():
 
 
 @bp.route("/signup", methods=["GET", "POST"])
-@limiter.limit("5 per minute")
+@limiter.limit("5 per minute", exempt_when=_is_logged_in)
 def signup():
     """Handle user registration."""
     if g.user is not None:
@@ -314,6 +538,8 @@ def forgot_password():
                 "Reset your Ruff password",
                 f"Reset your password: {reset_url}",
             )
+            user.password_reset_sent_at = datetime.utcnow()
+            db.session.commit()
         flash("If the account exists, a reset link has been sent.", "info")
         return redirect(url_for("main.login"))
     return render_template("forgot_password.html", form=form)
@@ -335,6 +561,7 @@ def reset_password(token):
     form = ResetPasswordForm()
     if form.validate_on_submit():
         user.set_password(form.password.data)
+        user.password_reset_sent_at = None
         db.session.commit()
         flash("Password reset successfully. Please log in.", "success")
         return redirect(url_for("main.login"))
@@ -346,7 +573,7 @@ def reset_password(token):
 def index():
     """Render the home page with stash creation form."""
     form = StashForm()
-    form.collection.choices = [(-1, "-- No Collection --")] + get_collection_choices()
+    form.collection.choices = collection_field_choices()
     return render_template("index.html", form=form)
 
 
@@ -355,7 +582,7 @@ def index():
 def stash():
     """Handle stash creation."""
     form = StashForm()
-    form.collection.choices = [(-1, "-- No Collection --")] + get_collection_choices()
+    form.collection.choices = collection_field_choices()
     
     if form.validate_on_submit():
         try:
@@ -379,10 +606,7 @@ def stash():
             db.session.flush()
             
             # Add tags if provided
-            if form.tags.data:
-                tags = [tag.strip().lower() for tag in form.tags.data.split(',') if tag.strip()]
-                for tag_name in tags:
-                    new_stash.add_tag(tag_name)
+            new_stash.add_tags(parse_tag_names(form.tags.data))
             
             db.session.commit()
             
@@ -397,6 +621,25 @@ def stash():
     return redirect(url_for("main.index"))
 
 
+STASHES_PER_PAGE = 50
+
+
+def format_stash_cursor(created_at: datetime, stash_id: str) -> str:
+    """Encode the position after which the next stash list page starts."""
+    return f"{created_at.isoformat()}_{stash_id}"
+
+
+def parse_stash_cursor(raw: Optional[str]):
+    """Decode a cursor from format_stash_cursor, or None if it is invalid."""
+    if not raw:
+        return None
+    created_at, _, stash_id = raw.partition("_")
+    try:
+        return datetime.fromisoformat(created_at), stash_id
+    except ValueError:
+        return None
+
+
 @bp.route("/stashes")
 @login_required
 def view_stashes():
@@ -407,39 +650,54 @@ def view_stashes():
         tag_name = request.args.get('tag', type=str)
         search_query = request.args.get('search', type=str)
         
-        # Build query - filter by current user
-        query = Stash.query.filter_by(user_id=g.user.id)
+        # Build query - filter by current user. Only the listed columns are
+        # read, so bodies stay in the database and no Stash objects are built.
+        query = (
+            select(*Stash.list_columns())
+            .outerjoin(Collection, Collection.id == Stash.collection_id)
+            .where(Stash.user_id == g.user.id)
+        )
         
         if collection_id:
-            query = query.filter_by(collection_id=collection_id)
+            query = query.where(Stash.collection_id == collection_id)
         
         if tag_name:
-            query = query.join(Stash.tags).filter(Tag.name == tag_name.lower())
+            query = query.join(Stash.tags).where(Tag.name == tag_name.lower())
         
         if search_query:
-            search_pattern = f"%{search_query}%"
-            query = query.filter(
+            query = query.where(stash_search_filter(search_query))
+        
+        # Keyset pagination: newest first, resuming after the cursor's row
+        cursor = parse_stash_cursor(request.args.get('cursor', type=str))
+        if cursor is not None:
+            created_at, stash_id = cursor
+            query = query.where(
                 or_(
-                    Stash.title.ilike(search_pattern),
-                    Stash.body.ilike(search_pattern),
-                    Stash.preview.ilike(search_pattern)
+                    Stash.created_at < created_at,
+                    and_(Stash.created_at == created_at, Stash.id < stash_id),
                 )
             )
-        
-        stashes = query.order_by(Stash.created_at.desc()).all()
+        rows = db.session.execute(
+            query.order_by(Stash.created_at.desc(), Stash.id.desc()).limit(STASHES_PER_PAGE + 1)
+        ).all()
+        next_cursor = None
+        if len(rows) > STASHES_PER_PAGE:
+            rows = rows[:STASHES_PER_PAGE]
+            next_cursor = format_stash_cursor(rows[-1].created_at, rows[-1].id)
         
         # Get all collections and tags for sidebar - filtered by current user
-        collection_dicts = get_user_collections_with_counts(g.user.id)
-        tags = get_user_tags_with_counts(g.user.id)
+        collection_dicts, tags = get_user_sidebar_counts(g.user.id)
         
         return render_template(
             "stashes.html",
-            stashes=[s.to_dict() for s in stashes],
+            stashes=Stash.serialize_rows(rows),
             collections=collection_dicts,
             tags=tags,
             current_collection=collection_id,
             current_tag=tag_name,
-            search_query=search_query
+            search_query=search_query,
+            next_cursor=next_cursor,
+            is_first_page=cursor is None,
         )
     except Exception as e:
         logger.error(f"Error loading stashes: {str(e)}")
@@ -466,8 +724,8 @@ def update_checklist(stash_id):
     """Update checklist items for a stash."""
     try:
         stash = Stash.query.filter_by(id=stash_id, user_id=g.user.id).first_or_404()
-        payload = request.get_json(silent=True) or {}
-        items = payload.get("checklist")
+        payload = request.get_json(silent=True)
+        items = payload.get("checklist") if isinstance(payload, dict) else None
         if not isinstance(items, list):
             return {"error": "Invalid checklist"}, 400
         stash.set_checklist(items)
@@ -487,13 +745,14 @@ def edit_stash(stash_id):
         stash = Stash.query.filter_by(id=stash_id, user_id=g.user.id).first_or_404()
         
         form = EditStashForm()
-        form.collection.choices = [(-1, "-- No Collection --")] + get_collection_choices()
+        form.collection.choices = collection_field_choices()
         
         if form.validate_on_submit():
             try:
                 stash.title = form.title.data.strip() if form.title.data else None
-                stash.body = form.body.data
-                stash.update_preview()
+                if form.body.data != stash.body:
+                    stash.body = form.body.data
+                    stash.update_preview()
                 stash.set_checklist(parse_checklist(form.checklist.data))
                 
                 # Update collection
@@ -503,11 +762,7 @@ def edit_stash(stash_id):
                     stash.collection_id = None
                 
                 # Update tags
-                stash.tags.clear()
-                if form.tags.data:
-                    tags = [tag.strip().lower() for tag in form.tags.data.split(',') if tag.strip()]
-                    for tag_name in tags:
-                        stash.add_tag(tag_name)
+                stash.set_tags(parse_tag_names(form.tags.data))
                 
                 db.session.commit()
                 flash("Stash updated successfully!", "success")
@@ -522,7 +777,7 @@ def edit_stash(stash_id):
         form.body.data = stash.body
         form.collection.data = stash.collection_id or -1
         form.tags.data = ', '.join([tag.name for tag in stash.tags])
-        form.checklist.data = json.dumps(stash.get_checklist())
+        form.checklist.data = json_dumps(stash.get_checklist())
         
         return render_template("editstash.html", form=form, stash=stash.to_dict())
     except Exception as e:
@@ -588,6 +843,7 @@ def create_collection():
             )
             db.session.add(new_collection)
             db.session.commit()
+            invalidate_collection_choices(g.user.id)
             
             flash(f"Collection '{form.name.data}' created successfully!", "success")
             logger.info(f"New collection created: {new_collection.id}")
@@ -616,6 +872,7 @@ def delete_collection(collection_id):
             
             db.session.delete(collection)
             db.session.commit()
+            invalidate_collection_choices(g.user.id)
             flash(f"Collection '{collection.name}' deleted successfully!", "success")
             logger.info(f"Collection deleted: {collection_id}")
     except Exception as e:
@@ -650,24 +907,27 @@ def delete_tag(tag_id):
         if tag is None:
             flash("Tag not found.", "error")
         else:
-            # Only allow tag removal for stashes owned by current user
-            user_stashes = (
-                Stash.query.join(Stash.tags)
-                .filter(Tag.id == tag_id, Stash.user_id == g.user.id)
-                .all()
-            )
+            # Only unlink stashes owned by the current user; no rows are loaded
+            removed = db.session.execute(
+                stash_tags.delete().where(
+                    stash_tags.c.tag_id == tag_id,
+                    stash_tags.c.stash_id.in_(
+                        select(Stash.id).where(Stash.user_id == g.user.id)
+                    ),
+                )
+            ).rowcount
 
-            if not user_stashes:
+            if not removed:
                 flash("Tag not found or access denied.", "error")
                 return redirect(url_for("main.view_tags"))
 
-            for stash in user_stashes:
-                stash.remove_tag(tag)
-
             # Delete the tag only if it's no longer used by any stash
-            if len(tag.stashes) == 0:
+            still_used = db.session.execute(
+                select(stash_tags.c.stash_id).where(stash_tags.c.tag_id == tag_id).limit(1)
+            ).first() is not None
+            if not still_used:
                 tag_name = tag.name
-                db.session.delete(tag)
+                tag.delete_row()
                 flash(f"Tag '{tag_name}' deleted successfully!", "success")
                 logger.info(f"Tag deleted: {tag_id}")
             else:
@@ -692,20 +952,19 @@ def delete_tag(tag_id):
 def export_data():
     """Export all user data as JSON."""
     try:
-        json_data = export_to_json(g.user)
-        
-        # Create file-like object
-        file = BytesIO(json_data.encode('utf-8'))
-        file.seek(0)
+        response = Response(
+            stream_with_context(iter_export_json(g.user)),
+            mimetype='application/json',
+        )
+        response.headers.set(
+            'Content-Disposition',
+            'attachment',
+            filename=f'ruff-export-{g.user.username}.json',
+        )
         
         logger.info(f"Data exported for user {g.user.username}")
         
-        return send_file(
-            file,
-            mimetype='application/json',
-            as_attachment=True,
-            download_name=f'ruff-export-{g.user.username}.json'
-        )
+        return response
     except Exception as e:
         logger.error(f"Error exporting data: {str(e)}")
         flash("Failed to export data. Please try again.", "error")
@@ -773,20 +1032,40 @@ def share_payload(stash_id):
     }, 200
 
 
+MAX_SHARED_CHECKLIST_ITEMS = 500
+MAX_SHARED_TAGS = 50
+
+
 @bp.route("/share/import", methods=["POST"])
 @login_required
 def import_shared_stash():
     """Import a shared stash payload into the current user's account."""
     try:
-        data = request.get_json() or {}
-        title = (data.get("title") or "").strip()
-        body = (data.get("body") or "").strip()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return {"error": "Invalid payload"}, 400
+        title = data.get("title") or ""
+        body = data.get("body") or ""
+        if not isinstance(title, str) or not isinstance(body, str):
+            return {"error": "Invalid payload"}, 400
+        title = title.strip()
+        body = body.strip()
         checklist_items = data.get("checklist")
         if not isinstance(checklist_items, list):
             checklist_items = []
+        tag_names = data.get("tags")
+        if not isinstance(tag_names, list):
+            tag_names = []
 
         if not body:
             return {"error": "Missing body"}, 400
+        # Bound the work a single payload can ask for before touching it
+        if len(body) > current_app.config.get("MAX_STASH_LENGTH", 50000):
+            return {"error": "Body too long"}, 400
+        if len(checklist_items) > MAX_SHARED_CHECKLIST_ITEMS:
+            return {"error": "Too many checklist items"}, 400
+        if len(tag_names) > MAX_SHARED_TAGS:
+            return {"error": "Too many tags"}, 400
 
         new_stash = Stash(
             title=title or None,
@@ -798,8 +1077,7 @@ def import_shared_stash():
         db.session.add(new_stash)
         db.session.flush()
 
-        for tag_name in data.get("tags", []) or []:
-            new_stash.add_tag(tag_name)
+        new_stash.add_tags(clean_tag_names(tag_names))
 
         db.session.commit()
         logger.info(f"Shared stash imported for user {g.user.username}: {new_stash.id}")
@@ -842,21 +1120,14 @@ def relay_home():
             max_entries = 8
         max_entries = max(3, min(max_entries, 20))
 
-        code = generate_relay_code()
-        while RelaySession.query.filter_by(code=code).first():
-            code = generate_relay_code()
-
-        relay = RelaySession(
-            code=code,
+        code = create_relay_session(
             owner_id=g.user.id,
             title=title,
             prompt=prompt or None,
             max_entries=max_entries,
         )
-        db.session.add(relay)
-        db.session.commit()
-        flash(f"Relay started. Share code {relay.code}.", "success")
-        return redirect(url_for("main.relay_view", code=relay.code))
+        flash(f"Relay started. Share code {code}.", "success")
+        return redirect(url_for("main.relay_view", code=code))
 
     flash("Invalid relay action.", "error")
     return redirect(url_for("main.relay_home"))
@@ -870,27 +1141,37 @@ def relay_start_from_stash(stash_id):
     title = stash.title or "Recess Relay"
     prompt = stash.body or ""
 
-    code = generate_relay_code()
-    while RelaySession.query.filter_by(code=code).first():
-        code = generate_relay_code()
-
-    relay = RelaySession(
-        code=code,
+    code = create_relay_session(
         owner_id=g.user.id,
         title=title,
         prompt=prompt,
         max_entries=8,
     )
-    db.session.add(relay)
-    db.session.commit()
-    flash(f"Relay started. Share code {relay.code}.", "success")
-    return redirect(url_for("main.relay_view", code=relay.code))
+    flash(f"Relay started. Share code {code}.", "success")
+    return redirect(url_for("main.relay_view", code=code))
+
+
+def list_loader_options(*options) -> list:
+    """
+    Loader options for list pages, plus raiseload('*') when SQLA_RAISELOAD is on.
+
+    Pass every relationship the page renders; any other lazy load then raises
+    during development and tests instead of becoming an N+1 in production.
+    """
+    options = list(options)
+    if current_app.config.get("SQLA_RAISELOAD"):
+        options.append(raiseload("*"))
+    return options
 
 
 @bp.route("/relay/<code>")
 def relay_view(code):
     """View a relay session."""
-    relay = RelaySession.query.filter_by(code=code.upper()).first_or_404()
+    relay = (
+        RelaySession.query.options(*list_loader_options(selectinload(RelaySession.entries)))
+        .filter_by(code=code.upper())
+        .first_or_404()
+    )
     entries = relay.entries
     entry_count = len(entries)
     can_add = (not relay.is_closed) and entry_count < relay.max_entries
@@ -908,7 +1189,21 @@ def relay_view(code):
 @bp.route("/relay/<code>/add", methods=["POST"])
 def relay_add(code):
     """Add a line to a relay session."""
-    relay = RelaySession.query.filter_by(code=code.upper()).first_or_404()
+    # Only these columns are needed; the entry itself goes in via Core. The
+    # row stays locked until the append commits.
+    relay = (
+        RelaySession.query.options(
+            load_only(
+                RelaySession.id,
+                RelaySession.code,
+                RelaySession.is_closed,
+                RelaySession.max_entries,
+            )
+        )
+        .filter_by(code=code.upper())
+        .with_for_update()
+        .first_or_404()
+    )
     if relay.is_closed:
         flash("This relay is closed.", "warning")
         return redirect(url_for("main.relay_view", code=relay.code))
@@ -921,24 +1216,15 @@ def relay_add(code):
         flash("Keep it short — max 240 characters per line.", "warning")
         return redirect(url_for("main.relay_view", code=relay.code))
 
-    entry_count = db.session.query(func.max(RelayEntry.position)).filter_by(session_id=relay.id).scalar() or 0
-    if entry_count >= relay.max_entries:
-        flash("This relay already hit its limit.", "warning")
-        return redirect(url_for("main.relay_view", code=relay.code))
-
     author = g.user.username if g.user else (request.form.get("author_name") or "Guest").strip()
     if not author:
         author = "Guest"
 
-    entry = RelayEntry(
-        session_id=relay.id,
-        author_name=author[:80],
-        body=body,
-        position=entry_count + 1,
-    )
-    db.session.add(entry)
-    db.session.commit()
-    return redirect(url_for("main.relay_view", code=relay.code))
+    # Read before commit expires the row, which would cost a reload
+    view_url = url_for("main.relay_view", code=relay.code)
+    if not append_relay_entry(relay.id, author[:80], body, relay.max_entries):
+        flash("This relay already hit its limit.", "warning")
+    return redirect(view_url)
 
 
 @bp.route("/relay/<code>/close", methods=["POST"])
@@ -952,9 +1238,10 @@ def relay_close(code):
 
     relay.is_closed = True
     relay.closed_at = datetime.utcnow()
+    view_url = url_for("main.relay_view", code=relay.code)
     db.session.commit()
     flash("Relay closed.", "success")
-    return redirect(url_for("main.relay_view", code=relay.code))
+    return redirect(view_url)
 
 
 @bp.route("/import", methods=["GET", "POST"])
@@ -980,19 +1267,14 @@ def import_data():
             flash("Invalid file type. Please upload a JSON file.", "error")
             return redirect(url_for("main.import_data"))
         
-        # Read file content
-        try:
-            json_content = file.read().decode('utf-8')
-        except UnicodeDecodeError:
-            flash("File encoding error. Please make sure the file is UTF-8 encoded.", "error")
-            return redirect(url_for("main.import_data"))
-        
-        # Import data
-        result = import_from_json(g.user, json_content)
+        # Pass the raw bytes through; the JSON parser validates UTF-8 itself
+        # and MAX_CONTENT_LENGTH bounds the upload size
+        result = import_from_json(g.user, file.read())
         
         if not result['success']:
             flash(f"Import failed: {result['error']}", "error")
             return redirect(url_for("main.import_data"))
+        invalidate_collection_choices(g.user.id)
         
         # Show success message with statistics
         message = (
@@ -1009,6 +1291,9 @@ def import_data():
         flash(message, "success")
         return redirect(url_for("main.view_stashes"))
     
+    except RequestEntityTooLarge:
+        # Handled by the app's 413 handler
+        raise
     except Exception as e:
         logger.error(f"Error importing data: {str(e)}")
         flash(f"Import failed: {str(e)}", "error")
@@ -1026,22 +1311,16 @@ def bulk_delete():
         if not stash_ids:
             return {"error": "No stashes selected"}, 400
         
-        # Validate that all stashes belong to the current user
-        stashes_to_delete = Stash.query.filter(
-            Stash.id.in_(stash_ids),
-            Stash.user_id == g.user.id
-        ).all()
+        if not isinstance(stash_ids, list):
+            return {"error": "Invalid stash selection"}, 400
         
-        deleted_count = len(stashes_to_delete)
+        # Only stashes owned by the current user are deleted
+        deleted_count = Stash.bulk_delete(stash_ids, g.user.id)
         
         if deleted_count != len(stash_ids):
             # Some stashes don't belong to this user or don't exist
             logger.warning(f"User {g.user.id} attempted to delete {len(stash_ids)} stashes but only {deleted_count} belong to them")
         
-        # Delete all validated stashes
-        for stash in stashes_to_delete:
-            db.session.delete(stash)
-        
         db.session.commit()
         logger.info(f"User {g.user.username} deleted {deleted_count} stashes via bulk action")
         
@@ -1065,30 +1344,25 @@ def bulk_move():
         if not stash_ids:
             return {"error": "No stashes selected"}, 400
         
-        # Validate that all stashes belong to the current user
-        stashes_to_move = Stash.query.filter(
-            Stash.id.in_(stash_ids),
-            Stash.user_id == g.user.id
-        ).all()
+        if not isinstance(stash_ids, list):
+            return {"error": "Invalid stash selection"}, 400
         
-        moved_count = len(stashes_to_move)
+        # Moves only the user's own stashes, and only into their own collection
+        collection_id = collection_id or None
+        moved_count = Stash.bulk_move(stash_ids, g.user.id, collection_id)
         
-        if moved_count != len(stash_ids):
-            logger.warning(f"User {g.user.id} attempted to move {len(stash_ids)} stashes but only {moved_count} belong to them")
-        
-        # If collection_id is provided, validate it belongs to the user
-        if collection_id:
-            collection = Collection.query.filter_by(
-                id=collection_id,
-                user_id=g.user.id
+        # Nothing moved: find out whether the collection was the reason
+        if not moved_count and collection_id is not None:
+            owned = db.session.execute(
+                select(Collection.id).where(
+                    Collection.id == collection_id, Collection.user_id == g.user.id
+                )
             ).first()
-            
-            if not collection:
+            if owned is None:
                 return {"error": "Collection not found or you don't have permission to use it"}, 403
         
-        # Move all validated stashes
-        for stash in stashes_to_move:
-            stash.collection_id = collection_id
+        if moved_count != len(stash_ids):
+            logger.warning(f"User {g.user.id} attempted to move {len(stash_ids)} stashes but only {moved_count} belong to them")
         
         db.session.commit()
         logger.info(f"User {g.user.username} moved {moved_count} stashes via bulk action")
@@ -11,18 +11,19 @@ from app import create_app
 from sockets import socketio
 
 
-def find_free_port(start_port=5000, max_attempts=10):
-    """Find a free port starting from start_port."""
-    for port in range(start_port, start_port + max_attempts):
+def find_free_port(start_port=5000):
+    """Return start_port if it is free, otherwise a port picked by the kernel."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            sock.bind(("127.0.0.1", port))
-            sock.close()
-            return port
+            sock.bind(("127.0.0.1", start_port))
+            return start_port
         except OSError:
-            continue
-    return start_port  # Return default if all ports busy
+            pass
+    # Port 0 asks the kernel for an unused ephemeral port in one bind
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
 
 
 if __name__ == "__main__":
@@ -5,7 +5,23 @@ Socket.IO setup and signaling events for WebRTC stash sharing.
 from flask import request
 from flask_socketio import SocketIO, join_room, leave_room, emit
 
-socketio = SocketIO(cors_allowed_origins="*")
+from utils import json_dumps, json_loads
+
+
+class _PacketJSON:
+    """Socket.IO packet codec backed by the orjson helpers in utils."""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # python-socketio passes compact separators, which orjson always uses
+        return json_dumps(obj)
+
+    @staticmethod
+    def loads(data, **kwargs):
+        return json_loads(data)
+
+
+socketio = SocketIO(cors_allowed_origins="*", json=_PacketJSON)
 
 
 def init_socketio(app):
@@ -14,13 +14,11 @@ class BulkActionsTestCase(unittest.TestCase):
         # Create a test user
         self.user = User(username='testuser', email='test@example.com', email_verified=True)
         self.user.set_password('password')
-        db.session.add(self.user)
-        db.session.commit()
         
         # Create another user
         self.other_user = User(username='other', email='other@example.com', email_verified=True)
         self.other_user.set_password('password')
-        db.session.add(self.other_user)
+        db.session.add_all([self.user, self.other_user])
         db.session.commit()
 
     def tearDown(self):
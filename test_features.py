@@ -6,10 +6,37 @@ Tests all CRUD operations for Stashes, Collections, and Tags
 
 import sys
 import os
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
 sys.path.insert(0, os.path.dirname(__file__))
 
+from flask import g
+from sqlalchemy import event, insert, select, text
+from sqlalchemy.orm import joinedload, raiseload, selectinload
+from werkzeug.security import generate_password_hash
+
+import auth_utils
 from app import create_app
-from models import db, Stash, Collection, Tag, User
+from config import TestingConfig
+from export_import import import_from_json
+from models import (
+    STASH_FTS_SQLITE_REBUILD,
+    db,
+    Stash,
+    Collection,
+    Tag,
+    User,
+    _has_stash_fts,
+    stash_search_filter,
+    stash_tags,
+)
+from utils import json_dumps, json_loads, uuid4_str
+
+LONG_TEXT_PHRASE = "This is my first stash with some important content "
+# Long enough that the stored preview is always truncated
+LONG_TEXT = LONG_TEXT_PHRASE * (TestingConfig.PREVIEW_LENGTH // len(LONG_TEXT_PHRASE) + 2)
+
 
 def test_collections():
     print("\n=== Testing Collections ===")
@@ -37,8 +64,9 @@ def test_collections():
         # Test deletion
         db.session.delete(col1)
         db.session.commit()
-        assert Collection.query.count() == 1
-        print(f"✓ Deleted collection, remaining: {Collection.query.count()}")
+        remaining = Collection.query.count()
+        assert remaining == 1
+        print(f"✓ Deleted collection, remaining: {remaining}")
         db.session.remove()
         db.drop_all()
 
@@ -75,18 +103,18 @@ def test_stashes():
         user = User(username="tester", email="tester@example.com")
         user.set_password("password")
         db.session.add(user)
-        db.session.commit()
+        # Fixture rows only need their ids; flushing skips extra commits
+        db.session.flush()
         # Create collection and tags
         col = Collection(user_id=user.id, name="Test", description="Test collection")
         tag1 = Tag(name="test-tag-1")
         tag2 = Tag(name="test-tag-2")
         db.session.add_all([col, tag1, tag2])
-        db.session.commit()
+        db.session.flush()
         
         # Create stashes
-        long_text = "This is my first stash with some important content " * 5  # Make it long
         stash1 = Stash(
-            body=long_text,
+            body=LONG_TEXT,
             title="First stash",
             checklist=[{"text": "Ship v1", "done": False}],
             collection_id=col.id,
@@ -108,6 +136,8 @@ def test_stashes():
 
         # Verify checklist
         assert len(stash1.get_checklist()) == 1
+        # Stored as a bare JSON list so older code can still read it
+        assert json_loads(stash1.checklist) == [{"text": "Ship v1", "done": False}]
         print("✓ Checklist stored")
         
         # Verify relationships
@@ -136,8 +166,9 @@ def test_stashes():
         # Test deletion
         db.session.delete(stash1)
         db.session.commit()
-        assert Stash.query.count() == 1
-        print(f"✓ Stash deleted, remaining: {Stash.query.count()}")
+        remaining = Stash.query.count()
+        assert remaining == 1
+        print(f"✓ Stash deleted, remaining: {remaining}")
         db.session.remove()
         db.drop_all()
 
@@ -173,18 +204,459 @@ def test_relationships():
         print(f"✓ Tag relationship works (many-to-many)")
         
         # Test cascade
-        col2 = Collection.query.filter_by(name="Main-Rel").first()
-        stashes_in_col = Stash.query.filter_by(collection_id=col2.id).all()
+        stashes_in_col = Stash.query.filter_by(collection_id=col.id).all()
         print(f"✓ Stashes in collection: {len(stashes_in_col)}")
+
+        # Any relationship read not loaded up front raises instead of querying
+        db.session.expunge_all()
+        loaded = db.session.execute(
+            select(Stash).options(
+                joinedload(Stash.collection),
+                selectinload(Stash.tags),
+                raiseload("*"),
+            )
+        ).scalar_one()
+        assert loaded.collection.name == "Main-Rel"
+        assert [t.name for t in loaded.tags] == ["rel-important"]
+        print("✓ Stash relationships load without lazy queries")
+        db.session.remove()
+        db.drop_all()
+
+@contextmanager
+def count_queries(engine):
+    """Count SQL statements executed on engine inside the block."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_stash_list_query_count():
+    print("\n=== Testing Stash List Query Count ===")
+    app = create_app('testing')
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="lister", email="lister@example.com", email_verified=True)
+        user.set_password("password")
+        db.session.add(user)
+        db.session.commit()
+        col = Collection(user_id=user.id, name="Listed")
+        db.session.add(col)
+        db.session.commit()
+        # Fixture rows go in with one executemany per table
+        stash_ids = [uuid4_str() for _ in range(20)]
+        db.session.execute(insert(Stash), [
+            {"id": stash_id, "body": f"List stash {i}", "user_id": user.id, "collection_id": col.id}
+            for i, stash_id in enumerate(stash_ids)
+        ])
+        tags = Tag.get_or_create_many(["tag-0", "tag-1", "tag-2", "shared"])
+        db.session.execute(insert(stash_tags), [
+            {"stash_id": stash_id, "tag_id": tags[name].id}
+            for i, stash_id in enumerate(stash_ids)
+            for name in (f"tag-{i % 3}", "shared")
+        ])
+        db.session.commit()
+        user_id = user.id
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+
+        with count_queries(db.engine) as statements:
+            response = client.get("/stashes")
+        assert response.status_code == 200
+        # user, stashes (+collection), tag names, sidebar counts
+        assert len(statements) <= 4, statements
+        print(f"✓ Listed 20 stashes in {len(statements)} queries")
         db.session.remove()
         db.drop_all()
 
+
+def test_stash_search():
+    print("\n=== Testing Stash Search ===")
+    app = create_app('testing')
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="searcher", email="searcher@example.com", email_verified=True)
+        user.set_password("password")
+        db.session.add(user)
+        db.session.commit()
+        fox = Stash(title="Animals", body="The quick brown fox", user_id=user.id)
+        dog = Stash(title="Quick notes", body="A lazy dog", user_id=user.id)
+        db.session.add_all([fox, dog])
+        db.session.commit()
+
+        def search(text):
+            return {
+                stash.id
+                for stash in Stash.query.filter(stash_search_filter(text)).all()
+            }
+
+        assert search("quick") == {fox.id, dog.id}
+        assert search("brow") == {fox.id}
+        assert search("quick dog") == {dog.id}
+        # Edits and deletes keep the index in sync
+        fox.body = "A sleepy cat"
+        db.session.commit()
+        assert search("fox") == set()
+        db.session.delete(dog)
+        db.session.commit()
+        assert search("lazy") == set()
+        print("✓ Search matches words and prefixes and follows edits")
+        db.session.remove()
+        db.drop_all()
+
+def test_stash_fts_detected_after_creation():
+    print("\n=== Testing FTS Table Detection ===")
+    app = create_app('testing')
+
+    with app.app_context():
+        # A worker that starts before the table exists must notice it later
+        assert not _has_stash_fts(db.engine)
+        db.create_all()
+        assert _has_stash_fts(db.engine)
+        print("✓ FTS table picked up once it exists")
+        db.session.remove()
+        db.drop_all()
+
+
+def test_stash_fts_survives_rowid_change():
+    print("\n=== Testing FTS Stable Keys ===")
+    app = create_app('testing')
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="vacuum", email="vacuum@example.com")
+        user.set_password("password")
+        db.session.add(user)
+        db.session.commit()
+        otter = Stash(body="Renumbered otter", user_id=user.id)
+        db.session.add(otter)
+        db.session.commit()
+        Stash.bulk_create([
+            {"user_id": user.id, "body": "Bulk heron"},
+            {"user_id": user.id, "body": "Bulk otter"},
+        ])
+        db.session.commit()
+
+        keys = db.session.execute(select(Stash.search_rowid)).scalars().all()
+        assert None not in keys and len(set(keys)) == 3
+        print("✓ Every inserted stash gets its own search key")
+
+        def search(text_):
+            return {s.body for s in Stash.query.filter(stash_search_filter(text_)).all()}
+
+        # A table copy (batch migration) or VACUUM can renumber rowids
+        db.session.execute(text("UPDATE stashes SET rowid = rowid + 100"))
+        db.session.commit()
+        assert search("otter") == {"Renumbered otter", "Bulk otter"}
+        assert search("heron") == {"Bulk heron"}
+        db.session.execute(text(STASH_FTS_SQLITE_REBUILD))
+        db.session.commit()
+        assert search("otter") == {"Renumbered otter", "Bulk otter"}
+        print("✓ Search is unaffected by rowid changes and survives a rebuild")
+        db.session.remove()
+        db.drop_all()
+
+
+def test_email_pool_sized_from_config():
+    print("\n=== Testing Email Pool ===")
+    app = create_app('testing')
+    app.config["EMAIL_WORKERS"] = 1
+    app.extensions["smtp_cfg"] = auth_utils.SmtpConfig.from_config(
+        {"SMTP_HOST": "smtp.example.com", "SMTP_FROM": "ruff@example.com"}
+    )
+    sent = []
+    original = auth_utils._send_email_sync
+    auth_utils._send_email_sync = lambda cfg, *args: sent.append(args)
+    try:
+        with app.app_context():
+            auth_utils.send_email("a@example.com", "Hi", "Body")
+            pool = app.extensions["email_pool"]
+        pool.shutdown(wait=True)
+    finally:
+        auth_utils._send_email_sync = original
+    assert pool._max_workers == 1
+    assert sent == [("a@example.com", "Hi", "Body")]
+    print("✓ Email pool created per app from EMAIL_WORKERS")
+
+
+def test_deleted_user_session_is_logged_out():
+    print("\n=== Testing Deleted User Session ===")
+    app = create_app('testing')
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="leaver", email="leaver@example.com", email_verified=True)
+        user.set_password("password")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+        assert client.get("/stashes").status_code == 200
+
+        db.session.delete(user)
+        db.session.commit()
+        response = client.get("/stashes")
+        assert response.status_code == 302
+        assert response.headers["Location"].endswith("/login")
+        print("✓ A deleted user's session no longer reaches login-only pages")
+        db.session.remove()
+        db.drop_all()
+
+
+def test_import_from_json():
+    print("\n=== Testing JSON Import ===")
+    app = create_app('testing')
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="importer", email="importer@example.com")
+        other = User(username="other", email="other@example.com")
+        user.set_password("password")
+        other.set_password("password")
+        db.session.add_all([user, other])
+        db.session.flush()
+        work = Collection(user_id=user.id, name="Work")
+        db.session.add_all([work, Tag(name="python")])
+        db.session.flush()
+        mine = Stash(body="Already imported", user_id=user.id)
+        theirs = Stash(body="Someone else's", user_id=other.id)
+        db.session.add_all([mine, theirs])
+        db.session.commit()
+
+        new_id = uuid4_str()
+        document = json_dumps({
+            "collections": [
+                {"id": "c-work", "name": "Work"},
+                {"id": "c-home", "name": "Home"},
+            ],
+            "tags": [{"name": "python"}, {"name": "garden"}],
+            "stashes": [
+                {"id": mine.id, "body": "Skipped, same owner"},
+                {"id": theirs.id, "body": "Clashes with another user",
+                 "collection_id": "c-home"},
+                {"id": new_id, "body": "Brand new", "collection_id": "c-work",
+                 "tags": ["python", "garden", "python"],
+                 "created_at": "2024-01-02T03:04:05Z"},
+                {"id": new_id, "body": "Duplicate in file"},
+            ],
+        })
+        results = import_from_json(user, document)
+        assert results["success"], results["error"]
+        assert results["created"] == {"collections": 1, "stashes": 2, "tags": 1}
+        assert results["skipped"] == {"collections": 1, "stashes": 2, "tags": 1}
+        print("✓ Existing collections and tags are reused, new ones created")
+
+        home = Collection.query.filter_by(user_id=user.id, name="Home").one()
+        moved = Stash.query.filter_by(body="Clashes with another user").one()
+        assert moved.id not in (theirs.id, new_id)
+        assert moved.user_id == user.id and moved.collection_id == home.id
+        assert db.session.get(Stash, theirs.id).user_id == other.id
+        print("✓ A stash ID owned by another user gets a fresh ID")
+
+        fresh = db.session.get(Stash, new_id)
+        assert fresh.body == "Brand new"
+        assert Stash.query.filter_by(body="Duplicate in file").count() == 0
+        print("✓ Duplicate IDs within one file are imported once")
+
+        assert fresh.created_at == datetime(2024, 1, 2, 3, 4, 5)
+        print("✓ Z-suffixed timestamps are stored as naive UTC")
+
+        assert fresh.collection_id == work.id
+        linked = db.session.execute(
+            select(Tag.name)
+            .join(stash_tags, stash_tags.c.tag_id == Tag.id)
+            .where(stash_tags.c.stash_id == new_id)
+        ).scalars().all()
+        assert sorted(linked) == ["garden", "python"]
+        print("✓ Tags are linked once per stash")
+        db.session.remove()
+        db.drop_all()
+
+
+def test_set_tags_sync():
+    print("\n=== Testing Tag Sync ===")
+    app = create_app('testing')
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="tagger", email="tagger@example.com")
+        user.set_password("password")
+        db.session.add(user)
+        db.session.commit()
+        stash = Stash(body="Tag me", user_id=user.id)
+        db.session.add(stash)
+        db.session.commit()
+
+        def linked():
+            return sorted(db.session.execute(
+                select(Tag.name)
+                .join(stash_tags, stash_tags.c.tag_id == Tag.id)
+                .where(stash_tags.c.stash_id == stash.id)
+            ).scalars())
+
+        stash.set_tags(["python", "flask"])
+        db.session.commit()
+        assert linked() == ["flask", "python"]
+        assert sorted(tag.name for tag in stash.tags) == ["flask", "python"]
+        print("✓ Tags added")
+
+        stash.set_tags(["python"])
+        db.session.commit()
+        assert linked() == ["python"]
+        assert [tag.name for tag in stash.tags] == ["python"]
+        print("✓ Tags removed")
+
+        stash.set_tags(["python", "flask"])
+        db.session.commit()
+        assert linked() == ["flask", "python"]
+        assert Tag.query.filter_by(name="flask").count() == 1
+        print("✓ Removed tag re-added without a duplicate Tag row")
+
+        stash.set_tags(["Python", "python", "FLASK"])
+        db.session.commit()
+        assert linked() == ["flask", "python"]
+        assert Tag.query.count() == 2
+        print("✓ Names differing only in case map to one tag")
+        db.session.remove()
+        db.drop_all()
+
+
+def test_oversized_upload():
+    print("\n=== Testing Oversized Uploads ===")
+    app = create_app('testing')
+    app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="uploader", email="uploader@example.com", email_verified=True)
+        user.set_password("password")
+        db.session.add(user)
+        db.session.commit()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user.id
+        oversized = b"x" * (app.config["MAX_CONTENT_LENGTH"] + 1)
+
+        response = client.post(
+            "/import",
+            data={"file": (BytesIO(oversized), "export.json")},
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 302
+        assert response.headers["Location"].endswith("/import")
+        with client.session_transaction() as sess:
+            assert sess["_flashes"] == [("error", "Import file is too large (limit 1 MB).")]
+        print("✓ Oversized import redirects back with a flash")
+
+        response = client.post("/stash", data={"body": oversized.decode()})
+        assert response.status_code == 413
+        print("✓ Oversized posts elsewhere get a plain 413")
+        db.session.remove()
+        db.drop_all()
+
+
+def test_login_rehash_keeps_tokens_valid():
+    print("\n=== Testing Login Re-hash and Tokens ===")
+    app = create_app('testing')
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="rehash", email="rehash@example.com", email_verified=True)
+        user.password_hash = generate_password_hash("password", method="pbkdf2:sha256:2000")
+        db.session.add(user)
+        db.session.commit()
+        assert user.password_needs_rehash()
+        verify_token = auth_utils.generate_token(user, "email_verify")
+
+        client = app.test_client()
+        response = client.post("/password/forgot", data={"email": "rehash@example.com"})
+        assert response.status_code == 302
+        reset_token = auth_utils.generate_token(user, "password_reset")
+        old_hash = user.password_hash
+
+        login = {"username": "rehash", "password": "password"}
+        assert client.post("/login", data=login).status_code == 302
+        db.session.refresh(user)
+        assert user.password_hash == old_hash
+        assert auth_utils.verify_token(reset_token, "password_reset", 3600) == (user, None)
+        print("✓ Login leaves the hash alone while a reset link is pending")
+
+        user.password_reset_sent_at = None
+        db.session.commit()
+        client.get("/logout")
+        assert client.post("/login", data=login).status_code == 302
+        db.session.refresh(user)
+        assert not user.password_needs_rehash()
+        assert auth_utils.verify_token(verify_token, "email_verify", 3600) == (user, None)
+        assert auth_utils.verify_token(reset_token, "password_reset", 3600) == (None, "invalid")
+        print("✓ Re-hash keeps verification links but retires old reset links")
+        db.session.remove()
+        db.drop_all()
+
+
+def test_deleted_tag_leaves_request_cache():
+    print("\n=== Testing Tag Cache After Delete ===")
+    app = create_app('testing')
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="pruner", email="pruner@example.com")
+        user.set_password("password")
+        db.session.add(user)
+        db.session.commit()
+        stash = Stash(body="Tagged", user_id=user.id)
+        db.session.add_all([stash, Tag(name="python")])
+        db.session.commit()
+
+        # Resolving an existing tag caches it for the rest of the app context
+        tag = Tag.get_or_create_many(["python"])["python"]
+        assert g.tag_cache == {"python": tag}
+        tag.delete_row()
+        assert "python" not in g.tag_cache
+        stash.set_tags(["python"])
+        db.session.commit()
+
+        tag_ids = db.session.execute(select(Tag.id).where(Tag.name == "python")).scalars().all()
+        linked = db.session.execute(
+            select(stash_tags.c.tag_id).where(stash_tags.c.stash_id == stash.id)
+        ).scalars().all()
+        assert len(tag_ids) == 1 and linked == tag_ids
+        print("✓ A tag deleted earlier in the request is created again, not reused")
+        db.session.remove()
+        db.drop_all()
+
+
 if __name__ == "__main__":
     try:
         test_collections()
         test_tags()
         test_stashes()
         test_relationships()
+        test_stash_list_query_count()
+        test_stash_search()
+        test_stash_fts_detected_after_creation()
+        test_stash_fts_survives_rowid_change()
+        test_email_pool_sized_from_config()
+        test_deleted_user_session_is_logged_out()
+        test_import_from_json()
+        test_set_tags_sync()
+        test_oversized_upload()
+        test_login_rehash_keeps_tokens_valid()
+        test_deleted_tag_leaves_request_cache()
         
         print("\n" + "="*50)
         print("✅ ALL TESTS PASSED!")
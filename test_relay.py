@@ -0,0 +1,133 @@
+
+import unittest
+from unittest import mock
+
+from sqlalchemy.exc import IntegrityError
+
+import routes
+from app import create_app
+from models import db, User, RelaySession, RelayEntry
+
+class RelayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # Create the relay owner
+        self.owner = User(username='owner', email='owner@example.com', email_verified=True)
+        self.owner.set_password('password')
+        db.session.add(self.owner)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def make_relay(self, code='ABC123', max_entries=8):
+        relay = RelaySession(code=code, owner_id=self.owner.id, title='Lunch relay', max_entries=max_entries)
+        db.session.add(relay)
+        db.session.commit()
+        return relay
+
+    def test_relay_view_with_raiseload(self):
+        # Testing turns unplanned lazy loads into errors
+        self.assertTrue(self.app.config['SQLA_RAISELOAD'])
+        relay = self.make_relay()
+        RelayEntry.append(relay.id, 'Ana', 'Once upon a time', relay.max_entries)
+        RelayEntry.append(relay.id, 'Ben', 'there was a relay', relay.max_entries)
+        db.session.commit()
+        owner_id = self.owner.id
+        db.session.expunge_all()
+
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = owner_id
+
+        response = client.get('/relay/abc123')
+
+        self.assertEqual(response.status_code, 200)
+        page = response.get_data(as_text=True)
+        self.assertIn('Once upon a time', page)
+        self.assertIn('there was a relay', page)
+        self.assertIn('2/8 lines', page)
+
+    def test_append_refused_once_full(self):
+        relay = self.make_relay(max_entries=2)
+        self.assertTrue(RelayEntry.append(relay.id, 'Ana', 'First', relay.max_entries))
+        self.assertTrue(RelayEntry.append(relay.id, 'Ben', 'Second', relay.max_entries))
+        self.assertFalse(RelayEntry.append(relay.id, 'Cy', 'Third', relay.max_entries))
+        db.session.commit()
+
+        entries = RelayEntry.query.filter_by(session_id=relay.id).order_by(RelayEntry.position).all()
+        self.assertEqual([e.position for e in entries], [1, 2])
+        self.assertEqual([e.body for e in entries], ['First', 'Second'])
+
+    def test_positions_are_unique_per_session(self):
+        relay = self.make_relay()
+        db.session.add(RelayEntry(session_id=relay.id, author_name='Ana', body='First', position=1))
+        db.session.commit()
+
+        db.session.add(RelayEntry(session_id=relay.id, author_name='Ben', body='Racing', position=1))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+
+    def test_append_relay_entry_retries_on_position_clash(self):
+        relay = self.make_relay()
+        relay_id, max_entries = relay.id, relay.max_entries
+        real_append = RelayEntry.append
+        calls = []
+
+        def clash_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise IntegrityError('INSERT', {}, Exception('UNIQUE constraint failed'))
+            return real_append(*args)
+
+        with mock.patch.object(RelayEntry, 'append', side_effect=clash_once):
+            self.assertTrue(routes.append_relay_entry(relay_id, 'Ana', 'First', max_entries))
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(RelayEntry.query.filter_by(session_id=relay_id).count(), 1)
+
+    def test_relay_add_stops_at_limit(self):
+        relay = self.make_relay(max_entries=1)
+        relay_id = relay.id
+        client = self.app.test_client()
+
+        response = client.post('/relay/abc123/add', data={'body': 'Only line', 'author_name': 'Ana'})
+        self.assertEqual(response.status_code, 302)
+        response = client.post('/relay/abc123/add', data={'body': 'One too many', 'author_name': 'Ben'})
+        self.assertEqual(response.status_code, 302)
+        with client.session_transaction() as sess:
+            self.assertEqual(sess['_flashes'], [('warning', 'This relay already hit its limit.')])
+
+        bodies = [e.body for e in RelayEntry.query.filter_by(session_id=relay_id)]
+        self.assertEqual(bodies, ['Only line'])
+
+    def test_create_relay_session_retries_on_code_collision(self):
+        self.make_relay(code='TAKEN1')
+        owner_id = self.owner.id
+
+        with mock.patch('routes.generate_relay_code', side_effect=['TAKEN1', 'FRESH1']):
+            code = routes.create_relay_session(owner_id=owner_id, title='Second relay', max_entries=8)
+
+        self.assertEqual(code, 'FRESH1')
+        self.assertEqual(RelaySession.query.count(), 2)
+        self.assertEqual(RelaySession.query.filter_by(code='FRESH1').one().title, 'Second relay')
+
+    def test_create_relay_session_gives_up_after_attempts(self):
+        self.make_relay(code='TAKEN1')
+        owner_id = self.owner.id
+
+        with mock.patch('routes.generate_relay_code', return_value='TAKEN1') as generate:
+            with self.assertRaises(RuntimeError):
+                routes.create_relay_session(owner_id=owner_id, title='Unlucky', max_entries=8)
+
+        self.assertEqual(generate.call_count, routes.RELAY_CODE_ATTEMPTS)
+        self.assertEqual(RelaySession.query.count(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
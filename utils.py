@@ -2,13 +2,96 @@
 Utility functions for the Ruff application.
 """
 
-from typing import Optional
+import binascii
+import json
+import os
+import threading
+from datetime import date, datetime
+from typing import Any, Optional, Union
 
 from flask import current_app
 
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup
+    orjson = None
+
 DEFAULT_PREVIEW_LENGTH = 100
 
 
+def _json_default(obj: Any) -> Any:
+    """Match orjson's ISO 8601 output for dates on the stdlib fallback."""
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_dumps(obj: Any, indent: bool = False) -> str:
+    """Serialize obj to a JSON string, using orjson when it is installed."""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(obj, option=option).decode()
+    return json.dumps(obj, indent=2 if indent else None, default=_json_default)
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """
+    Parse a JSON document, using orjson when it is installed.
+
+    Both backends raise a json.JSONDecodeError subclass on invalid input.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class _UuidPool:
+    """
+    Hand out uuid4-formatted strings from a per-thread random buffer.
+
+    Refilling 4KB at a time from ``os.urandom`` serves 256 IDs per syscall
+    and skips building a ``uuid.UUID`` object for every ID.
+    """
+
+    _CHUNK_SIZE = 4096
+    _local = threading.local()
+
+    @classmethod
+    def next(cls) -> str:
+        local = cls._local
+        buf = getattr(local, "buf", None)
+        off = getattr(local, "off", 0)
+        if buf is None or off >= len(buf):
+            buf = local.buf = bytearray(os.urandom(cls._CHUNK_SIZE))
+            off = 0
+        raw = buf[off:off + 16]
+        local.off = off + 16
+        # Stamp the RFC 4122 version (4) and variant bits
+        raw[6] = (raw[6] & 0x0F) | 0x40
+        raw[8] = (raw[8] & 0x3F) | 0x80
+        h = binascii.hexlify(raw).decode()
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+    @classmethod
+    def reset(cls) -> None:
+        """Discard buffered randomness so a forked child never reuses it."""
+        cls._local = threading.local()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_UuidPool.reset)
+
+
+def uuid4_str() -> str:
+    """Return a random uuid4 string, as str(uuid.uuid4()) would."""
+    return _UuidPool.next()
+
+
+def format_timestamp(value: datetime) -> str:
+    """Format a naive timestamp as YYYY-MM-DD HH:MM:SS (cheaper than strftime)."""
+    return value.isoformat(sep=" ", timespec="seconds")
+
+
 def _get_preview_length(default: int = DEFAULT_PREVIEW_LENGTH) -> int:
     """Read preview length from app config when available."""
     try: